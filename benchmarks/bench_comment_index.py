@@ -0,0 +1,47 @@
+"""
+Times filling in the content of every comment of a synthetic document from comments.xml.
+
+Compares the indexed lookup (`build_comment_index`) against the previous linear `find()` over comments.xml per comment; the indexed time per comment should stay flat as the comment count grows.
+
+Usage:
+  python benchmarks/bench_comment_index.py [comment_count ...]
+"""
+import sys
+import time
+
+from synthetic import build_roots
+from main import NAMESPACES, resolve_comment_ranges, sort_comment_replies, build_comment_index, get_comment_content
+
+DEFAULT_SIZES = [1_000, 5_000, 10_000]
+
+def get_comment_content_by_search(comments_root, comments):
+  """The lookup used before `build_comment_index`: one scan of comments.xml per comment."""
+  for comment in comments:
+    comment_elem = comments_root.find(f"./w:comment[@w:id='{comment['id']}']", NAMESPACES)
+    comment["content"] = comment_elem.find(".//w:t", NAMESPACES).text
+  return comments
+
+def time_lookup(comments_root, comment_ranges, indexed: bool):
+  start = time.perf_counter()
+  comment_index = build_comment_index(comments_root) if indexed else None
+  for paragraph_comments in comment_ranges.values():
+    comments = sort_comment_replies(paragraph_comments)
+    if indexed:
+      get_comment_content(comment_index, comments)
+    else:
+      get_comment_content_by_search(comments_root, comments)
+  return time.perf_counter() - start
+
+def main():
+  sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+  print(f"{'comments':>10} {'indexed (s)':>12} {'search (s)':>12}")
+  for size in sizes:
+    # One comment per paragraph
+    document_root, comments_root = build_roots(size, comment_density=1.0)
+    comment_ranges = resolve_comment_ranges(document_root)
+    indexed = time_lookup(comments_root, comment_ranges, indexed=True)
+    search = time_lookup(comments_root, comment_ranges, indexed=False)
+    print(f"{size:>10} {indexed:>12.3f} {search:>12.3f}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,36 @@
+"""
+Times paragraph + comment extraction on synthetic documents of growing size.
+
+Comment ranges are resolved in a single pass over the document, so the time per paragraph should stay roughly constant from 1k to 100k paragraphs (linear growth overall).
+
+Usage:
+  python benchmarks/bench_extraction.py [paragraph_count ...]
+"""
+import sys
+import time
+
+from synthetic import build_roots
+from main import extract_paragraphs, resolve_comment_ranges, build_comment_index, extract_comments_from_paragraph
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+def run(paragraph_count: int):
+  document_root, comments_root = build_roots(paragraph_count)
+
+  start = time.perf_counter()
+  paragraphs = extract_paragraphs(document_root)
+  comment_ranges = resolve_comment_ranges(document_root)
+  comment_index = build_comment_index(comments_root)
+  for paragraph in paragraphs:
+    paragraph.comments = extract_comments_from_paragraph(comment_index, comment_ranges.get(paragraph.id, {}))
+  return time.perf_counter() - start
+
+def main():
+  sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+  print(f"{'paragraphs':>12} {'total (s)':>10} {'per paragraph (us)':>20}")
+  for size in sizes:
+    elapsed = run(size)
+    print(f"{size:>12} {elapsed:>10.3f} {elapsed / size * 1e6:>20.2f}")
+
+if __name__ == "__main__":
+  main()
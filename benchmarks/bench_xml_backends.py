@@ -0,0 +1,40 @@
+"""
+Compares the XML backends (xml.etree.ElementTree and lxml, when installed) on synthetic documents of growing size.
+
+Times the parse of document.xml and the paragraph + comment range extraction on the parsed tree.
+
+Usage:
+  python benchmarks/bench_xml_backends.py [paragraph_count ...]
+"""
+import io
+import sys
+import time
+
+from synthetic import generate_parts
+from main import XmlBackend, lxml_etree, extract_paragraphs, resolve_comment_ranges
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+def run(backend: XmlBackend, xml_bytes: bytes):
+  start = time.perf_counter()
+  document_root = backend.parse(io.BytesIO(xml_bytes))
+  parsed = time.perf_counter()
+  extract_paragraphs(document_root)
+  resolve_comment_ranges(document_root)
+  return parsed - start, time.perf_counter() - parsed
+
+def main():
+  sizes = [int(size) for size in sys.argv[1:]] or DEFAULT_SIZES
+  backends = [XmlBackend("etree")] + ([XmlBackend("lxml")] if lxml_etree is not None else [])
+  if lxml_etree is None:
+    print("lxml is not installed, only timing the etree backend.")
+
+  print(f"{'paragraphs':>12} {'backend':>8} {'parse (s)':>10} {'extract (s)':>12}")
+  for size in sizes:
+    xml_bytes = generate_parts(size)["word/document.xml"].encode("utf-8")
+    for backend in backends:
+      parse_time, extract_time = run(backend, xml_bytes)
+      print(f"{size:>12} {backend.name:>8} {parse_time:>10.3f} {extract_time:>12.3f}")
+
+if __name__ == "__main__":
+  main()
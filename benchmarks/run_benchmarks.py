@@ -0,0 +1,134 @@
+"""
+Times every stage of the pipeline on synthetic .docx files and saves the results as JSON, so they can be compared between revisions.
+
+Stages: unzip, parse, extract_paragraphs, comments (range resolution and content lookup), generate_instructions and export.
+
+Usage:
+  python benchmarks/run_benchmarks.py [--paragraphs N ...] [--repeat N] [--output results.json] [--compare baseline.json]
+"""
+import io
+import os
+import json
+import time
+import zipfile
+import platform
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+from synthetic import write_docx
+from main import (
+  XmlBackend, XML_BACKENDS, extract_paragraphs, resolve_comment_ranges, build_comment_index,
+  build_comment_threads, extract_comments_from_paragraph, generate_instructions, export_instructions_to_txt,
+)
+
+STAGES = ["unzip", "parse", "extract_paragraphs", "comments", "generate_instructions", "export"]
+
+def run_pipeline(docx_path, output_file, backend: XmlBackend, context_level: int, edits: bool):
+  """Runs the pipeline once, returning the wall time of every stage."""
+  timings = {}
+
+  start = time.perf_counter()
+  with zipfile.ZipFile(docx_path, "r") as docx:
+    document_bytes = docx.read("word/document.xml")
+    comments_bytes = docx.read("word/comments.xml")
+    comments_extended_bytes = docx.read("word/commentsExtended.xml")
+  timings["unzip"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  document_root = backend.parse(io.BytesIO(document_bytes))
+  comments_root = backend.parse(io.BytesIO(comments_bytes))
+  comments_extended_root = backend.parse(io.BytesIO(comments_extended_bytes))
+  timings["parse"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  paragraphs = extract_paragraphs(document_root)
+  timings["extract_paragraphs"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  comment_ranges = resolve_comment_ranges(document_root)
+  comment_index = build_comment_index(comments_root)
+  comment_threads = build_comment_threads(comments_root, comments_extended_root)
+  for paragraph in paragraphs:
+    paragraph.comments = extract_comments_from_paragraph(comment_index, comment_ranges.get(paragraph.id, {}), comment_threads)
+  timings["comments"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  instructions = generate_instructions(paragraphs, context_level, edits)
+  timings["generate_instructions"] = time.perf_counter() - start
+
+  start = time.perf_counter()
+  export_instructions_to_txt(paragraphs, instructions, output_file)
+  timings["export"] = time.perf_counter() - start
+
+  return timings
+
+def get_revision():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def compare(results, baseline):
+  """Prints the ratio of every stage's median time against the same case in `baseline`."""
+  baseline_cases = {json.dumps(case["params"], sort_keys=True): case for case in baseline["cases"]}
+  print(f"\nCompared to {baseline.get('revision') or 'baseline'} (current / baseline median):")
+  for case in results["cases"]:
+    baseline_case = baseline_cases.get(json.dumps(case["params"], sort_keys=True))
+    if baseline_case is None:
+      continue
+    ratios = [f"{stage}={case['stages'][stage]['median'] / baseline_case['stages'][stage]['median']:.2f}x" for stage in STAGES if baseline_case["stages"][stage]["median"]]
+    print(f"  {case['params']['paragraphs']:>8} paragraphs: {' '.join(ratios)}")
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmark every stage of the pipeline on synthetic DOCX files.")
+  parser.add_argument("--paragraphs", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Paragraph counts of the synthetic files (default: 1000 10000 100000).")
+  parser.add_argument("--comment_density", type=float, default=0.1, help="Fraction of the paragraphs with a comment thread (default: 0.1).")
+  parser.add_argument("--edit_density", type=float, default=0.2, help="Fraction of the paragraphs with an insertion and a deletion (default: 0.2).")
+  parser.add_argument("--reply_depth", type=int, default=1, help="Number of replies in every comment thread (default: 1).")
+  parser.add_argument("--overlap_density", type=float, default=0.1, help="Fraction of the comment threads overlapped by another comment range (default: 0.1).")
+  parser.add_argument("-c", "--context_level", type=int, default=1, help="Context level of the generated instructions (default: 1).")
+  parser.add_argument("--repeat", type=int, default=3, help="Number of runs per file, the min and median are reported (default: 3).")
+  parser.add_argument("--xml_backend", choices=XML_BACKENDS, default="auto", help="XML backend to benchmark (default: auto).")
+  parser.add_argument("--output", type=str, default="benchmark_results.json", help="JSON file to save the results to (default: benchmark_results.json).")
+  parser.add_argument("--compare", type=str, default=None, help="JSON results of a previous run to compare against.")
+  args = parser.parse_args()
+
+  backend = XmlBackend(args.xml_backend)
+  results = {
+    "revision": get_revision(),
+    "python": platform.python_version(),
+    "backend": backend.name,
+    "cases": [],
+  }
+
+  with tempfile.TemporaryDirectory() as temp_dir:
+    output_file = os.path.join(temp_dir, "proofread_instructions.txt")
+    print(f"{'paragraphs':>10} " + " ".join(f"{stage:>21}" for stage in STAGES))
+    for paragraph_count in args.paragraphs:
+      params = {
+        "paragraphs": paragraph_count, "comment_density": args.comment_density, "edit_density": args.edit_density,
+        "reply_depth": args.reply_depth, "overlap_density": args.overlap_density, "context_level": args.context_level,
+      }
+      docx_path = os.path.join(temp_dir, f"synthetic_{paragraph_count}.docx")
+      write_docx(
+        docx_path, paragraph_count, comment_density=args.comment_density, edit_density=args.edit_density,
+        reply_depth=args.reply_depth, overlap_density=args.overlap_density,
+      )
+
+      runs = [run_pipeline(docx_path, output_file, backend, args.context_level, True) for _ in range(args.repeat)]
+      stages = {stage: {"min": min(run[stage] for run in runs), "median": statistics.median(run[stage] for run in runs)} for stage in STAGES}
+      results["cases"].append({"params": params, "stages": stages})
+      print(f"{paragraph_count:>10} " + " ".join(f"{stages[stage]['median']:>20.4f}s" for stage in STAGES))
+
+  with open(args.output, "w", encoding="utf-8") as file:
+    json.dump(results, file, indent=2)
+  print(f"\nResults saved to {args.output}")
+
+  if args.compare:
+    with open(args.compare, "r", encoding="utf-8") as file:
+      compare(results, json.load(file))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,172 @@
+"""
+Synthetic .docx generator for the benchmarks.
+
+Builds valid WordprocessingML documents with a configurable number of paragraphs, density of insertions/deletions, comments, replies per comment thread and overlapping comment ranges.
+
+Usage:
+  python benchmarks/synthetic.py <output.docx> [--paragraphs N] [--comment_density D] [--edit_density D] [--reply_depth N] [--overlap_density D] [--seed N]
+"""
+import os
+import sys
+import random
+import zipfile
+import argparse
+import xml.etree.ElementTree as ET
+
+# Make main.py importable when running the benchmarks from any directory
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from main import NAMESPACES
+
+NS_DECLARATIONS = f'xmlns:w="{NAMESPACES["w"]}" xmlns:w14="{NAMESPACES["w14"]}" xmlns:w15="{NAMESPACES["w15"]}"'
+
+WORDS = "the quick brown fox jumps over a lazy dog while some sample text is proofread by the editor".split()
+
+CONTENT_TYPES_XML = (
+  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+  '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+  '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+  '<Default Extension="xml" ContentType="application/xml"/>'
+  '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+  '<Override PartName="/word/comments.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.comments+xml"/>'
+  '<Override PartName="/word/commentsExtended.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.commentsExtended+xml"/>'
+  '</Types>'
+)
+
+PACKAGE_RELS_XML = (
+  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+  '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+  '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+  '</Relationships>'
+)
+
+DOCUMENT_RELS_XML = (
+  '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+  '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+  '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/comments" Target="comments.xml"/>'
+  '<Relationship Id="rId2" Type="http://schemas.microsoft.com/office/2011/relationships/commentsExtended" Target="commentsExtended.xml"/>'
+  '</Relationships>'
+)
+
+def sentence(rng: random.Random, word_count=8):
+  return " ".join(rng.choice(WORDS) for _ in range(word_count))
+
+def run_xml(text: str, deleted=False):
+  tag = "w:delText" if deleted else "w:t"
+  return f'<w:r><{tag} xml:space="preserve">{text}</{tag}></w:r>'
+
+class SyntheticDocument:
+  """Accumulates the XML of the document, comments and commentsExtended parts while paragraphs are generated."""
+  def __init__(self, rng: random.Random):
+    self.rng = rng
+    self.paragraphs = []
+    self.comments = []
+    self.comments_extended = []
+    self.annotation_count = 0
+
+  def next_annotation_id(self):
+    """Returns a new w:id, shared by insertions, deletions and comments as in Word's own documents."""
+    self.annotation_count += 1
+    return self.annotation_count - 1
+
+  def add_comment(self, parent_para_id=None):
+    """Adds a comment (a reply when `parent_para_id` is given) and returns its (id, paraId)."""
+    comment_id = self.next_annotation_id()
+    para_id = f"{0x40000000 + comment_id:08X}" # Keep comment paraIds apart from the document ones
+    self.comments.append(
+      f'<w:comment w:id="{comment_id}" w:author="Editor" w:initials="E">'
+      f'<w:p w14:paraId="{para_id}"><w:r><w:t>Comment number {comment_id}: {sentence(self.rng, 5)}</w:t></w:r></w:p>'
+      f'</w:comment>'
+    )
+    parent = f' w15:paraIdParent="{parent_para_id}"' if parent_para_id else ""
+    self.comments_extended.append(f'<w15:commentEx w15:paraId="{para_id}"{parent} w15:done="0"/>')
+    return comment_id, para_id
+
+  def add_paragraph(self, index: int, commented: bool, edited: bool, reply_depth: int, overlapping: bool):
+    rng = self.rng
+    parts = [run_xml(f"Paragraph {index}. {sentence(rng)} ")]
+
+    if edited:
+      parts.append(f'<w:ins w:id="{self.next_annotation_id()}" w:author="Editor">{run_xml(sentence(rng, 3) + " ")}</w:ins>')
+      parts.append(f'<w:del w:id="{self.next_annotation_id()}" w:author="Editor">{run_xml(sentence(rng, 3) + " ", deleted=True)}</w:del>')
+
+    if commented:
+      # A comment thread: the main comment and its replies all share the same range
+      thread = [self.add_comment()]
+      for _ in range(reply_depth):
+        thread.append(self.add_comment(parent_para_id=thread[0][1]))
+      parts.extend(f'<w:commentRangeStart w:id="{comment_id}"/>' for comment_id, _ in thread)
+      parts.append(run_xml(sentence(rng) + " "))
+
+      if overlapping:
+        # Another comment starting inside the thread's range and ending after it
+        overlap_id, _ = self.add_comment()
+        parts.append(f'<w:commentRangeStart w:id="{overlap_id}"/>')
+        parts.append(run_xml(sentence(rng, 4) + " "))
+        parts.extend(f'<w:commentRangeEnd w:id="{comment_id}"/>' for comment_id, _ in thread)
+        parts.append(run_xml(sentence(rng, 4)))
+        parts.append(f'<w:commentRangeEnd w:id="{overlap_id}"/>')
+      else:
+        parts.extend(f'<w:commentRangeEnd w:id="{comment_id}"/>' for comment_id, _ in thread)
+
+    parts.append(run_xml(". End of paragraph."))
+    self.paragraphs.append(f'<w:p w14:paraId="{index:08X}" w14:textId="{rng.getrandbits(31):08X}">{"".join(parts)}</w:p>')
+
+  def parts(self):
+    """Returns the generated parts, mapping their name in the .docx zip to their XML."""
+    declaration = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    return {
+      "[Content_Types].xml": CONTENT_TYPES_XML,
+      "_rels/.rels": PACKAGE_RELS_XML,
+      "word/_rels/document.xml.rels": DOCUMENT_RELS_XML,
+      "word/document.xml": f'{declaration}<w:document {NS_DECLARATIONS}><w:body>{"".join(self.paragraphs)}<w:sectPr/></w:body></w:document>',
+      "word/comments.xml": f'{declaration}<w:comments {NS_DECLARATIONS}>{"".join(self.comments)}</w:comments>',
+      "word/commentsExtended.xml": f'{declaration}<w15:commentsEx {NS_DECLARATIONS}>{"".join(self.comments_extended)}</w15:commentsEx>',
+    }
+
+def generate_parts(paragraphs=1000, comment_density=0.1, edit_density=0.0, reply_depth=0, overlap_density=0.0, seed=0):
+  """
+  Generates the parts of a synthetic .docx file.
+    `comment_density`: Fraction of the paragraphs with a comment thread.
+    `edit_density`: Fraction of the paragraphs with an insertion and a deletion.
+    `reply_depth`: Number of replies in every comment thread.
+    `overlap_density`: Fraction of the comment threads overlapped by another comment range.
+  """
+  rng = random.Random(seed)
+  document = SyntheticDocument(rng)
+  for index in range(paragraphs):
+    commented = rng.random() < comment_density
+    edited = rng.random() < edit_density
+    overlapping = commented and rng.random() < overlap_density
+    document.add_paragraph(index, commented, edited, reply_depth, overlapping)
+  return document.parts()
+
+def build_roots(paragraphs=1000, **options):
+  """Returns the (document_root, comments_root) pair for a synthetic document, see `generate_parts` for the options."""
+  parts = generate_parts(paragraphs, **options)
+  return ET.fromstring(parts["word/document.xml"]), ET.fromstring(parts["word/comments.xml"])
+
+def write_docx(path, paragraphs=1000, **options):
+  """Writes a synthetic .docx file to `path`, see `generate_parts` for the options."""
+  with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+    for name, xml in generate_parts(paragraphs, **options).items():
+      docx.writestr(name, xml)
+
+def main():
+  parser = argparse.ArgumentParser(description="Write a synthetic DOCX file for benchmarking.")
+  parser.add_argument("output", help="Path of the DOCX file to write.")
+  parser.add_argument("--paragraphs", type=int, default=1000, help="Number of paragraphs (default: 1000).")
+  parser.add_argument("--comment_density", type=float, default=0.1, help="Fraction of the paragraphs with a comment thread (default: 0.1).")
+  parser.add_argument("--edit_density", type=float, default=0.0, help="Fraction of the paragraphs with an insertion and a deletion (default: 0.0).")
+  parser.add_argument("--reply_depth", type=int, default=0, help="Number of replies in every comment thread (default: 0).")
+  parser.add_argument("--overlap_density", type=float, default=0.0, help="Fraction of the comment threads overlapped by another comment range (default: 0.0).")
+  parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator (default: 0).")
+  args = parser.parse_args()
+
+  write_docx(
+    args.output, args.paragraphs, comment_density=args.comment_density, edit_density=args.edit_density,
+    reply_depth=args.reply_depth, overlap_density=args.overlap_density, seed=args.seed,
+  )
+
+if __name__ == "__main__":
+  main()
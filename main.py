@@ -1,17 +1,217 @@
+import io
 import os
+import sys
+import glob
+import json
+import time
+import hashlib
 import zipfile
+import logging
+import asyncio
 import argparse
-from collections import defaultdict
+import multiprocessing
+import functools
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from contextlib import contextmanager
+from collections import defaultdict, namedtuple, deque
 import re
-import copy
 import xml.etree.ElementTree as ET
 
+try:
+  from lxml import etree as lxml_etree
+except ImportError: # lxml is optional, the standard library parser is used without it
+  lxml_etree = None
+
+logger = logging.getLogger(__name__)
+
 # XML namespace for WordprocessingML
 NAMESPACES = {
   "w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
-  "w14": "http://schemas.microsoft.com/office/word/2010/wordml"
+  "w14": "http://schemas.microsoft.com/office/word/2010/wordml",
+  "w15": "http://schemas.microsoft.com/office/word/2012/wordml"
 }
 
+# Fully qualified ("{namespace}name") tags and attributes, compared directly against the elements instead of building XPath expressions on every call
+W_P = f'{{{NAMESPACES["w"]}}}p'
+W_R = f'{{{NAMESPACES["w"]}}}r'
+W_INS = f'{{{NAMESPACES["w"]}}}ins'
+W_DEL = f'{{{NAMESPACES["w"]}}}del'
+W_T = f'{{{NAMESPACES["w"]}}}t'
+W_DEL_TEXT = f'{{{NAMESPACES["w"]}}}delText'
+W_COMMENT = f'{{{NAMESPACES["w"]}}}comment'
+W_COMMENT_RANGE_START = f'{{{NAMESPACES["w"]}}}commentRangeStart'
+W_COMMENT_RANGE_END = f'{{{NAMESPACES["w"]}}}commentRangeEnd'
+W_ID = f'{{{NAMESPACES["w"]}}}id'
+W14_PARA_ID = f'{{{NAMESPACES["w14"]}}}paraId'
+W14_TEXT_ID = f'{{{NAMESPACES["w14"]}}}textId'
+W15_COMMENT_EX = f'{{{NAMESPACES["w15"]}}}commentEx'
+W15_PARA_ID = f'{{{NAMESPACES["w15"]}}}paraId'
+W15_PARA_ID_PARENT = f'{{{NAMESPACES["w15"]}}}paraIdParent'
+W15_DONE = f'{{{NAMESPACES["w15"]}}}done'
+
+COMMENTS_PART = "word/comments.xml"
+COMMENTS_EXTENDED_PART = "word/commentsExtended.xml"
+DOCUMENT_PART = "word/document.xml"
+
+# Elements that can make a paragraph a working paragraph, matched in the raw markup by the triage pre-scan without parsing the XML
+TRIAGE_COMMENTS_ELEMENTS = [b"commentRangeStart"]
+TRIAGE_ELEMENTS = [b"ins", b"del", b"commentRangeStart"]
+# Start tag of the root element (after the XML declaration and comments) and its namespace declarations, read to find the prefix bound to the "w" namespace
+TRIAGE_ROOT_PATTERN = re.compile(rb"(?:\xef\xbb\xbf)?(?:\s+|<\?.*?\?>|<!--.*?-->)*<[^\s/>!?][^>]*>", re.DOTALL)
+TRIAGE_XMLNS_PATTERN = re.compile(rb"""\sxmlns(?::([^\s=]+))?\s*=\s*(["'])(.*?)\2""", re.DOTALL)
+TRIAGE_CHUNK_SIZE = 1024 * 1024
+STDIN_PATH = "-" # CLI input reading the .docx file from stdin
+TRIAGE_OVERLAP = 32 # Longer than any match, so a match split between two chunks is still found
+
+XML_BACKENDS = ["auto", "lxml", "etree"]
+
+# Version of the paragraph records stored in the cache, bump it whenever their format changes
+CACHE_VERSION = 6
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"), "docx-proofreader")
+DEFAULT_CACHE_SIZE_MB = 256
+
+DEFAULT_SERVE_PORT = 8765
+DEFAULT_MAX_UPLOAD_MB = 100
+WARM_UP_TIMEOUT = 60
+# Content types of the responses of `serve`, for every output format ("json" being a single document with every instruction)
+SERVE_CONTENT_TYPES = {"txt": "text/plain; charset=utf-8", "jsonl": "application/x-ndjson", "json": "application/json"}
+
+class XmlBackend:
+  """
+  Parses XML with xml.etree.ElementTree, or with lxml when requested by name.
+  Both build ElementTree-compatible elements, so the extraction functions work the same with either backend.
+  lxml's C parser is faster, but the extraction walks the tree in Python, which is slower over lxml's element proxies
+  and outweighs the parsing gain (see benchmarks/bench_xml_backends.py), so `auto` picks etree and lxml stays opt-in.
+  """
+  def __init__(self, name="auto"):
+    if name == "auto":
+      name = "etree"
+    if name == "lxml" and lxml_etree is None:
+      raise ImportError("The lxml XML backend was requested but lxml is not installed.")
+    self.name = name
+
+  def parse(self, source):
+    """Returns the root element of the XML in `source` (a path or binary file object)."""
+    if self.name == "lxml":
+      # lxml keeps XML comments and processing instructions as elements, leave them out like ElementTree does
+      parser = lxml_etree.XMLParser(remove_comments=True, remove_pis=True, huge_tree=True)
+      return lxml_etree.parse(source, parser).getroot()
+    return ET.parse(source).getroot()
+
+  def iter_paragraphs(self, source):
+    """
+    Parses `source` incrementally, yielding every outermost w:p element as soon as it's complete (nested paragraphs are still inside it).
+    Once the caller resumes, the paragraph is cleared and detached from the tree, so memory stays bounded by the size of the largest paragraph.
+    """
+    if self.name == "lxml":
+      # lxml filters the events by tag in C and knows the parent of every element, so there's no need to go through every start event
+      for _, elem in lxml_etree.iterparse(source, events=("end",), tag=W_P, remove_comments=True, remove_pis=True, huge_tree=True):
+        if next(elem.iterancestors(W_P), None) is not None:
+          continue # Nested paragraph, yielded along with its outermost paragraph
+        yield elem
+        elem.clear()
+        elem.getparent().remove(elem)
+      return
+
+    ancestors = [] # Elements started but not ended yet
+    open_paragraphs = 0
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+      if event == "start":
+        ancestors.append(elem)
+        if elem.tag == W_P:
+          open_paragraphs += 1
+        continue
+
+      ancestors.pop()
+      if elem.tag != W_P:
+        continue
+      open_paragraphs -= 1
+      if open_paragraphs > 0:
+        continue # Nested paragraph, yielded along with its outermost paragraph
+      yield elem
+      elem.clear()
+      if ancestors:
+        ancestors[-1].remove(elem)
+
+class Profiler:
+  """
+  Records the wall time, CPU time and number of calls of every stage of a run, along with counters of the items processed.
+  Stages can be nested (e.g. a generator pulling items from another one): time is only charged to the innermost active stage, so the stages add up to the total.
+  When not `enabled`, only the counters are kept, so the per-item timing of the pipeline's generators costs nothing.
+  """
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.stages = {} # { "{stage}": { "wall": float, "cpu": float, "calls": int } }
+    self.counters = defaultdict(int)
+    self.active = [] # Names of the stages entered and not exited yet
+    self.last_charge = None # (wall, cpu) time when the innermost active stage was last charged
+
+  def get_stage(self, name):
+    return self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+
+  def charge(self):
+    """Charges the time elapsed since the last charge to the innermost active stage."""
+    now = (time.perf_counter(), time.process_time())
+    if self.active:
+      stage = self.get_stage(self.active[-1])
+      stage["wall"] += now[0] - self.last_charge[0]
+      stage["cpu"] += now[1] - self.last_charge[1]
+    self.last_charge = now
+
+  @contextmanager
+  def stage(self, name):
+    if not self.enabled:
+      yield
+      return
+    self.charge()
+    self.active.append(name)
+    self.get_stage(name)["calls"] += 1
+    try:
+      yield
+    finally:
+      self.charge()
+      self.active.pop()
+
+  def iterate(self, name, iterable):
+    """Yields the items of `iterable`, charging the work done to produce each one to the stage `name` (but not the work done by the consumer in between)."""
+    if not self.enabled:
+      yield from iterable
+      return
+    iterator = iter(iterable)
+    while True:
+      with self.stage(name):
+        item = next(iterator, StopIteration)
+      if item is StopIteration:
+        return
+      yield item
+
+  def count(self, name, amount=1):
+    self.counters[name] += amount
+
+  def merge(self, profile: dict):
+    """Adds the stages and counters of another profile (as returned by `to_dict`), e.g. from a batch worker."""
+    for name, other in profile["stages"].items():
+      stage = self.get_stage(name)
+      for key in stage:
+        stage[key] += other[key]
+    for name, amount in profile["counters"].items():
+      self.counters[name] += amount
+
+  def to_dict(self):
+    return {"stages": self.stages, "counters": dict(self.counters)}
+
+  def format_report(self):
+    lines = [f"{'Stage':<22} {'Wall (s)':>10} {'CPU (s)':>10} {'Calls':>7}"]
+    for name, stage in self.stages.items():
+      lines.append(f"{name:<22} {stage['wall']:>10.4f} {stage['cpu']:>10.4f} {stage['calls']:>7}")
+    total_wall = sum(stage["wall"] for stage in self.stages.values())
+    total_cpu = sum(stage["cpu"] for stage in self.stages.values())
+    lines.append(f"{'total':<22} {total_wall:>10.4f} {total_cpu:>10.4f}")
+    lines.append("Counters: " + ", ".join(f"{name}={amount}" for name, amount in self.counters.items()))
+    return "\n".join(lines)
+
 # Formatting functions
 def format_insertion_text(text):
   return f"**{text}**"  # Bold formatting for insertions
@@ -22,6 +222,7 @@ def format_deletion_text(text):
 def has_edits(content):
   """
   Checks if the content contains text encompassed by insertion (**{text}**) or deletion (--{text}--) formats.
+  Legacy helper working on rendered text only: the pipeline no longer calls it, working paragraphs are found from the insertions and deletions counted while parsing (see `is_working_paragraph`).
   """
   edit_pattern = r"\*\*.*?\*\*|--.*?--" # Matches either **text** or --text--
   return bool(re.search(edit_pattern, content))
@@ -33,132 +234,235 @@ def get_plain_text(element: ET.Element):
   parts = [text for text in element.itertext()]
   return "".join(parts)
 
+# Kinds of the spans of a paragraph
+SPAN_TEXT = "text"
+SPAN_INSERTION = "insertion"
+SPAN_DELETION = "deletion"
+
+SPAN_FORMATTERS = {SPAN_TEXT: str, SPAN_INSERTION: format_insertion_text, SPAN_DELETION: format_deletion_text}
+
+class Span:
+  """A run of text of a paragraph: plain text, an insertion or a deletion, starting at character `offset` of the paragraph's plain text."""
+  __slots__ = ("kind", "text", "offset")
+
+  def __init__(self, kind, text, offset):
+    self.kind = kind
+    self.text = text
+    self.offset = offset
+
+  def __eq__(self, other):
+    return isinstance(other, Span) and (self.kind, self.text, self.offset) == (other.kind, other.text, other.offset)
+
+  def __repr__(self):
+    return f"Span({self.kind!r}, {self.text!r}, {self.offset})"
+
+class Paragraph:
+  """
+  A paragraph with text, kept as the spans found while parsing so every output format is rendered from them (see `render_spans_txt` and `render_spans_json`).
+  `insertions` and `deletions` count the edit spans, `comments` is the list of comments anchored to the paragraph (see `extract_comments_from_paragraph`).
+  `text_id` is the w14:textId Word changes whenever the paragraph's text changes (None if the file doesn't have it).
+  """
+  __slots__ = ("id", "spans", "insertions", "deletions", "comments", "text_id")
+
+  def __init__(self, id, spans: list[Span], comments: list = None, text_id=None):
+    self.id = id
+    self.spans = spans
+    self.insertions = sum(1 for span in spans if span.kind == SPAN_INSERTION)
+    self.deletions = sum(1 for span in spans if span.kind == SPAN_DELETION)
+    self.comments = comments if comments is not None else []
+    self.text_id = text_id
+
+  def to_dict(self):
+    """Returns the paragraph as JSON-compatible data, e.g. for the cache."""
+    return {"id": self.id, "text_id": self.text_id, "spans": [[span.kind, span.text, span.offset] for span in self.spans], "comments": self.comments}
+
+  @classmethod
+  def from_dict(cls, data: dict):
+    return cls(data["id"], [Span(*span) for span in data["spans"]], data["comments"], data["text_id"])
+
+  def get_comment_ids(self):
+    """Returns the IDs of the comments anchored to the paragraph, replies included."""
+    return [comment_id for comment in self.comments for comment_id in [comment["id"]] + [reply["id"] for reply in comment["replies"]]]
+
+def render_spans_txt(spans: list[Span]):
+  """Renders the spans as text, with insertions as **{text}** and deletions as --{text}--."""
+  return "".join(SPAN_FORMATTERS[span.kind](span.text) for span in spans)
+
+def render_spans_json(spans: list[Span]):
+  """Renders the spans as JSON-compatible data: a list of { "kind": str, "text": str }."""
+  return [{"kind": span.kind, "text": span.text} for span in spans]
+
+def slice_spans(spans: list[Span], start: int, end: int):
+  """Returns the parts of the spans between the `start` and `end` offsets of the paragraph's plain text (e.g. a comment's anchor)."""
+  sliced = []
+  for span in spans:
+    span_end = span.offset + len(span.text)
+    if span_end <= start or span.offset >= end:
+      continue
+    slice_start = max(start, span.offset)
+    sliced.append(Span(span.kind, span.text[slice_start - span.offset:min(end, span_end) - span.offset], slice_start))
+  return sliced
+
+def make_paragraph(p: ET.Element):
+  """Returns the Paragraph of the element `p`, or None if it has no text."""
+  spans = get_paragraph_spans(p)
+  if spans:
+    return Paragraph(p.attrib[W14_PARA_ID], spans, text_id=p.attrib.get(W14_TEXT_ID))
+  return None
+
 def extract_paragraphs(root: ET.Element):
   paragraphs = []
-  for p in root.findall(".//w:p", NAMESPACES):
-    paragraph_id = p.attrib[f'{{{NAMESPACES["w14"]}}}paraId']
-    paragraph_text = get_paragraph_text(p)
-    if (paragraph_text):
-      paragraphs.append({"id": paragraph_id, "content": paragraph_text})
+  for p in root.iter(W_P):
+    if p is root:
+      continue # Like ".//w:p", don't include the root itself
+    paragraph = make_paragraph(p)
+    if paragraph:
+      paragraphs.append(paragraph)
   return paragraphs
 
-def get_paragraph_text(element: ET.Element):
+def iter_paragraphs_streaming(document_xml, comment_index: dict, backend: XmlBackend = None, comment_threads: dict = None, include_resolved=False):
   """
-  Recursive function that collects the text from elements containing text, with proper formatting depending on its tag name (ins, del, r).
+  Reads the paragraphs of word/document.xml incrementally with `iterparse`, yielding each paragraph record (with its comments) as soon as the paragraph is complete.
+  Finished paragraphs are cleared and detached from the tree (see `XmlBackend.iter_paragraphs`), so memory stays bounded by the size of the largest paragraph instead of the whole document.
+  Paragraphs nested in another one (e.g. in text boxes) are yielded right after their outermost paragraph, in the same order as `extract_paragraphs`.
   """
-  text_parts = []
-  
+  backend = backend or XmlBackend()
+
+  for elem in backend.iter_paragraphs(document_xml):
+    # Comments spanning more than one paragraph are ignored, so the paragraph alone is enough to resolve its comments
+    comment_ranges = {}
+    get_comment_anchors([elem], None, {}, comment_ranges, [0])
+
+    for p in elem.iter(W_P):
+      paragraph = make_paragraph(p)
+      if paragraph:
+        paragraph.comments = extract_comments_from_paragraph(comment_index, comment_ranges.get(paragraph.id, {}), comment_threads, include_resolved)
+        yield paragraph
+
+def get_paragraph_spans(element: ET.Element, spans: list[Span] = None):
+  """
+  Recursive function that collects the text from elements containing text as spans, whose kind depends on its tag name (ins, del, r).
+  Consecutive runs of plain text are kept as a single span.
+  """
+  spans = spans if spans is not None else []
+
   for child in element:
-    tag = child.tag.split("}")[-1]
-    
-    if tag == "ins":
-      # For an insertion block, get all text inside it and apply formatting once.
-      ins_text = get_plain_text(child)
-      if ins_text:  # Only add formatted text if there's something to format
-        text_parts.append(format_insertion_text(ins_text))
-
-    elif tag == "del":
-      # For a deletion block, do the same.
-      del_text = get_plain_text(child)
-      if del_text:
-        text_parts.append(format_deletion_text(del_text))
-    
+    tag = child.tag
+
+    # An insertion or deletion block becomes a single span with all the text inside it
+    if tag == W_INS or tag == W_DEL:
+      kind = SPAN_INSERTION if tag == W_INS else SPAN_DELETION
+      text = get_plain_text(child)
+
     # For a r, we want to get its text without formatting.
-    elif tag == "r":
+    elif tag == W_R:
       # There might be multiple text parts inside a run.
-      r_text = get_plain_text(child)
-      text_parts.append(r_text)
+      kind, text = SPAN_TEXT, get_plain_text(child)
 
     # Otherwise, recursively process the child element
     else:
-      text_parts.append(get_paragraph_text(child))
+      get_paragraph_spans(child, spans)
+      continue
 
-  full_paragraph = "".join(text_parts)
-  return full_paragraph
+    if not text:
+      continue # Only add spans with something to format
+    if not spans:
+      spans.append(Span(kind, text, 0))
+    elif kind == SPAN_TEXT and spans[-1].kind == SPAN_TEXT:
+      spans[-1].text += text
+    else:
+      spans.append(Span(kind, text, spans[-1].offset + len(spans[-1].text)))
 
-def get_comment_ids_in_paragraph(paragraph_el: ET.Element):
-  comment_ids = []
+  return spans
 
-  # Find all <w:commentRangeStart> inside <w:p>
-  comment_starts = paragraph_el.findall(".//w:commentRangeStart", NAMESPACES)
+def resolve_comment_ranges(root: ET.Element):
+  """
+  Walks the whole document once, tracking the open comment ranges, and collects the anchor of every comment whose range starts and ends in the same paragraph.
+  Returns:
+    dict[str, dict[str, dict]]: A dictionary where:
+      - Keys (str) represent the paraId of the paragraph owning the comments.
+      - Values (dict) map the IDs of the comments in that paragraph (in order of appearance) to:
+        - start (int), end (int): Offsets of the text associated with the comment in the paragraph's plain text (the offsets of its spans, see `slice_spans`).
+        - content (str): Empty, filled later by `get_comment_content`.
+        - replies (list): Empty, filled later by `sort_comment_replies`.
+  """
+  resolved = {}
+  get_comment_anchors(root, None, {}, resolved, [0])
+  return resolved
 
-  for start in comment_starts:
-    comment_id = start.attrib[f'{{{NAMESPACES["w"]}}}id']
-    # Check if the corresponding <w:commentRangeEnd> is in the same paragraph
-    comment_end = paragraph_el.find(f".//w:commentRangeEnd[@w:id='{comment_id}']", NAMESPACES)
-    if comment_end is not None:
-      # Add to the comment list
-      comment_ids.append(comment_id)
-    else:
-      print(f"Couldn't find end of comment with ID={comment_id} in the same paragraph.")
-      print("Ignoring comment from list...")
-  
-  return comment_ids
+def discard_comment_range(comment_id, paragraph_id, resolved: dict):
+  logger.warning(f"Couldn't find end of comment with ID={comment_id} in the same paragraph. Ignoring comment from list...")
+  paragraph_comments = resolved[paragraph_id]
+  del paragraph_comments[comment_id]
+  if not paragraph_comments:
+    del resolved[paragraph_id]
 
-# Recursive function to extract text within comment ranges while handling nesting properly
-def get_comment_anchors(parent: ET.Element, active_comments: list, comments: dict, ancestors: list[ET.Element]):
+# Recursive function to locate the comment ranges while handling nesting properly
+def get_comment_anchors(parent: ET.Element, paragraph_id, open_comments: dict, resolved: dict, position: list[int], in_text=False):
   """
-  Returns:
-    dict[str, dict]: A dictionary where:
-      - Keys (str) represent comment IDs.
-      - Values (dict) contain:
-        - anchor (str): The text associated with the comment.
+  `open_comments` maps the ID of every comment range that has started but not ended yet to the paraId of the paragraph where it started.
+  Comments are added to `resolved` (see `resolve_comment_ranges`) when their range starts, and dropped again if the range doesn't end in the same paragraph.
+  `position` holds the offset reached in the current paragraph's plain text. It's counted like `get_paragraph_spans` does: all the text inside runs, insertions and deletions (`in_text`).
   """
   for elem in parent:
-    tag_name = elem.tag.split("}")[-1]  # Remove namespace
+    tag = elem.tag
 
-    # Push current element to ancestors stack
-    ancestors.append(elem)
+    # Entering a new paragraph, any range still open once it's done ends somewhere else
+    if tag == W_P:
+      current_paragraph_id = elem.attrib.get(W14_PARA_ID)
+      get_comment_anchors(elem, current_paragraph_id, open_comments, resolved, [0])
+      for comment_id, start_paragraph_id in list(open_comments.items()):
+        if start_paragraph_id == current_paragraph_id:
+          del open_comments[comment_id]
+          discard_comment_range(comment_id, start_paragraph_id, resolved)
+      if in_text:
+        position[0] += len(get_plain_text(elem)) # A nested paragraph (e.g. in a text box) is also part of the text of its run
 
     # Start tracking a new comment range
-    if tag_name == "commentRangeStart":
-      comment_id = elem.attrib[f'{{{NAMESPACES["w"]}}}id']
-      active_comments.append(comment_id)
-
-    # Collect text for all active comments
-    elif active_comments and tag_name in ["t", "delText"]:
-      text = elem.text
-
-      # Check grandparent for <w:ins> or <w:del>
-      grandparent = ancestors[-3] if len(ancestors) >= 3 else None
-      if grandparent is not None:
-        grandparent_tag = grandparent.tag.split("}")[-1]
-        if grandparent_tag == "ins":
-          text = format_insertion_text(text)
-        elif grandparent_tag == "del":
-          text = format_deletion_text(text)
-
-      # Assign text to ALL active comments
-      for comment_id in active_comments:
-        comments[comment_id]["anchor"] += text
-
-    # Recursively process child elements
-    get_comment_anchors(elem, active_comments, comments, ancestors)
+    elif tag == W_COMMENT_RANGE_START:
+      comment_id = elem.attrib[W_ID]
+      open_comments[comment_id] = paragraph_id
+      resolved.setdefault(paragraph_id, {})[comment_id] = {"start": position[0], "end": position[0], "content": "", "replies": []}
 
     # Stop tracking when reaching a matching comment end
-    if tag_name == "commentRangeEnd":
-      comment_id = elem.attrib[f'{{{NAMESPACES["w"]}}}id']
-      if comment_id in active_comments:
-        active_comments.remove(comment_id)  # Remove the completed comment range
-        
-    # Pop current element from ancestors stack
-    ancestors.pop()
+    elif tag == W_COMMENT_RANGE_END:
+      comment_id = elem.attrib[W_ID]
+      if comment_id in open_comments:
+        start_paragraph_id = open_comments.pop(comment_id)  # Remove the completed comment range
+        if start_paragraph_id != paragraph_id:
+          discard_comment_range(comment_id, start_paragraph_id, resolved)
+        else:
+          resolved[paragraph_id][comment_id]["end"] = position[0]
+
+    # Recursively process child elements, counting their text once inside a run, insertion or deletion
+    else:
+      child_in_text = in_text or tag == W_R or tag == W_INS or tag == W_DEL
+      if child_in_text and elem.text:
+        position[0] += len(elem.text)
+      get_comment_anchors(elem, paragraph_id, open_comments, resolved, position, child_in_text)
 
-  return comments  # Return updated comments dictionary
+    if in_text and elem.tail:
+      position[0] += len(elem.tail)
 
-def sort_comment_replies(comments):
+  return resolved
+
+def sort_comment_replies(comments, comment_threads: dict = None):
   """
-    Adds a reply list to the list of comments if there are comments that share the same anchor value.
+    Adds a reply list to the list of comments, from the threads of commentsExtended.xml when given (see `build_comment_threads`).
+    Without them (older files don't have that part), comments that share the same anchor range are taken as replies.
     Returns:
       list[dict]: A list of paragraphs, each represented as:
         - id (str): Comment ID.
         - replies (list[dict]): Associated comments, each with:
           - id (str): Comment ID.
   """
+  if comment_threads is not None:
+    return thread_comment_replies(comments, comment_threads)
+
   # Group comments by anchor
   grouped = defaultdict(list)
   for comment_id, comment in comments.items():
-    grouped[comment['anchor']].append({"id": comment_id, **comment}) # grouped = { "{anchor_value}": [{ "id": str, "anchor": str }] }
+    grouped[comment['start'], comment['end']].append({"id": comment_id, **comment}) # grouped = { (start, end): [{ "id": str, "start": int, "end": int }] }
 
   # Process grouped comments
   sorted_comments = []
@@ -171,12 +475,66 @@ def sort_comment_replies(comments):
 
   return sorted_comments
 
-def get_comment_content(comments_root: ET.Element, comments: dict):
+def get_thread_root(comment_threads: dict, comment_id):
+  """Returns the ID of the top-level comment of the thread `comment_id` belongs to."""
+  seen = {comment_id}
+  parent_id = comment_threads.get(comment_id, {}).get("parent")
+  while parent_id is not None and parent_id not in seen:
+    seen.add(parent_id)
+    comment_id = parent_id
+    parent_id = comment_threads.get(comment_id, {}).get("parent")
+  return comment_id
+
+def thread_comment_replies(comments, comment_threads: dict):
+  """Same as `sort_comment_replies`, with replies attached to their thread's top-level comment when it's anchored to the same paragraph."""
+  roots = {comment_id: get_thread_root(comment_threads, comment_id) for comment_id in comments}
+
+  main_comments = {}
+  for comment_id, comment in comments.items():
+    if roots[comment_id] == comment_id or roots[comment_id] not in comments:
+      main_comments[comment_id] = {"id": comment_id, **comment, "replies": []}
+
+  for comment_id in comments:
+    if comment_id not in main_comments:
+      main_comments[roots[comment_id]]["replies"].append({"id": comment_id})
+
+  return list(main_comments.values())
+
+def build_comment_index(comments_root: ET.Element):
+  """Maps the ID of every comment in comments.xml to its element, so each comment is looked up in O(1) instead of scanning the file."""
+  return {comment.attrib[W_ID]: comment for comment in comments_root.iter(W_COMMENT)}
+
+def build_comment_threads(comments_root: ET.Element, comments_extended_root: ET.Element):
+  """
+  Reads the reply threads from commentsExtended.xml, where every comment is identified by the paraId of its last paragraph and replies point to their parent's with w15:paraIdParent.
+  Returns:
+    dict[str, dict]: Maps the ID of every comment found in commentsExtended.xml to:
+      - parent (str | None): ID of the comment it replies to, None for a top-level comment.
+      - resolved (bool): Whether its thread was marked as done (w15:done on the top-level comment).
+  """
+  comment_ids = {} # { "{paraId}": "{comment_id}" }
+  for comment in comments_root.iter(W_COMMENT):
+    paragraphs = comment.findall("w:p", NAMESPACES)
+    if paragraphs:
+      comment_ids[paragraphs[-1].attrib.get(W14_PARA_ID)] = comment.attrib[W_ID]
+
+  comment_threads = {}
+  for comment_ex in comments_extended_root.iter(W15_COMMENT_EX):
+    comment_id = comment_ids.get(comment_ex.attrib.get(W15_PARA_ID))
+    if comment_id is not None:
+      comment_threads[comment_id] = {"parent": comment_ids.get(comment_ex.attrib.get(W15_PARA_ID_PARENT)), "done": comment_ex.attrib.get(W15_DONE) == "1"}
+
+  # Decided once here, so skipping resolved threads is a lookup per comment
+  for comment_id, thread in comment_threads.items():
+    thread["resolved"] = comment_threads.get(get_thread_root(comment_threads, comment_id), thread)["done"]
+  return comment_threads
+
+def get_comment_content(comment_index: dict, comments: dict):
   # Update the content for each comment and its replies
   for comment in comments:
     # Update top-level comment content
     comment_id = comment["id"]
-    comment_elem = comments_root.find(f"./w:comment[@w:id='{comment_id}']", NAMESPACES)
+    comment_elem = comment_index.get(comment_id)
     if comment_elem is None:
       raise ValueError("Couldn't find comment with id=" + comment_id)
     comment["content"] = comment_elem.find(".//w:t", NAMESPACES).text
@@ -184,7 +542,7 @@ def get_comment_content(comments_root: ET.Element, comments: dict):
     # Update replies content
     for reply in comment["replies"]:
       reply_id = reply["id"]
-      reply_elem = comments_root.find(f"./w:comment[@w:id='{reply_id}']", NAMESPACES)
+      reply_elem = comment_index.get(reply_id)
       if reply_elem is None:
         raise ValueError("Couldn't find reply with id=" + reply_id)
       
@@ -192,121 +550,1064 @@ def get_comment_content(comments_root: ET.Element, comments: dict):
 
   return comments
 
-def extract_comments_from_paragraph(document_root: ET.Element, comments_root: ET.Element, paragraph_id):
-  """Extract the anchor for comments found in the paragraph identified with `paragraph_id`"""
-  paragraph_root = document_root.find(f".//*[@w14:paraId='{paragraph_id}']", NAMESPACES)
+def extract_comments_from_paragraph(comment_index: dict, paragraph_comments: dict, comment_threads: dict = None, include_resolved=False):
+  """
+  Sorts the replies and fills the content of the comments found in a paragraph (as resolved by `resolve_comment_ranges`), using the comments.xml index from `build_comment_index`
+  and the commentsExtended.xml threads from `build_comment_threads` when the file has them.
+  Threads marked as resolved are left out unless `include_resolved`.
+  """
+  if comment_threads is not None and not include_resolved and paragraph_comments:
+    paragraph_comments = {comment_id: comment for comment_id, comment in paragraph_comments.items() if not comment_threads.get(comment_id, {}).get("resolved")}
+
+  if len(paragraph_comments) == 0: return [] # Return an empty list of comments
 
-  comment_ids = get_comment_ids_in_paragraph(paragraph_root)
-  
-  if len(comment_ids) == 0: return [] # Return an empty list of comments
-  
-  # Map comment ids to dict with the initial format of a comment:
-  # { "{comment_id}": { "anchor": str, "content": str, "replies": list[{ "id": str, "content": str }] } }
-  comments = {comment_id: {"anchor": "", "content": "", "replies": []} for comment_id in comment_ids}  
-  
-  # Proceed with retrieving the commented sections of the paragraph
-  comments = get_comment_anchors(paragraph_root, [], comments, []) # Fill the anchor values 
-  comments = sort_comment_replies(comments) # { "id": str, "anchor": str, "replies": list[{ "id": str }] }
-  comments = get_comment_content(comments_root, comments)
+  # Comments come in the initial format of a comment:
+  # { "{comment_id}": { "start": int, "end": int, "content": str, "replies": list[{ "id": str, "content": str }] } }
+  comments = sort_comment_replies(paragraph_comments, comment_threads) # { "id": str, "start": int, "end": int, "replies": list[{ "id": str }] }
+  comments = get_comment_content(comment_index, comments)
 
   return comments
 
-def get_context(paragraphs: list, index: int, context_level=0) -> list:
+# A view over the shared list of paragraphs: paragraphs[start:end] as context, with the paragraphs at `working_indexes` as working paragraphs
+Context = namedtuple("Context", ["start", "end", "working_indexes"])
+
+def get_context(paragraphs: list, index: int, context_level=0) -> Context:
   """
-    Returns a selected paragraph and its surrounding paraghraphs according to the value of `context_level`.
+    Returns a view of a selected paragraph and its surrounding paraghraphs according to the value of `context_level`.
       `context_level=1`: returns selected paragraph along with the preceding and former paragraph.
       `context_level=2`: returns selected paragraph along with the 2 preceding and former paragraphs, and so on...
   """
   start = max(0, index - context_level)  # Ensure start is at least 0
   end = min(len(paragraphs), index + context_level + 1)  # Ensure end doesn't exceed list length
-  context = copy.deepcopy(paragraphs[start:end])
+  return Context(start, end, (index,))
+
+def is_working_paragraph(paragraph: Paragraph, include_edits: bool):
+  """Checks if the paragraph has comments or insertions/deletions (as counted while parsing, see `Paragraph`)"""
+  return bool(paragraph.comments) or (include_edits and (paragraph.insertions > 0 or paragraph.deletions > 0))
+
+class ParagraphWindow:
+  """
+  The most recent paragraphs read from a stream, indexed by their position in the whole document, so context views (Context) keep working while older paragraphs are discarded.
+  `len()` is the number of paragraphs read so far.
+  """
+  def __init__(self):
+    self.paragraphs = deque()
+    self.offset = 0 # Document index of self.paragraphs[0]
+
+  def __len__(self):
+    return self.offset + len(self.paragraphs)
+
+  def __getitem__(self, index):
+    if index < self.offset:
+      raise IndexError(f"Paragraph {index} was already discarded from the window.")
+    return self.paragraphs[index - self.offset]
+
+  def append(self, paragraph):
+    self.paragraphs.append(paragraph)
+
+  def discard_before(self, index):
+    while self.paragraphs and self.offset < index:
+      self.paragraphs.popleft()
+      self.offset += 1
 
-  # Mark the active paragraph
-  for i, paragraph in enumerate(context):
-    paragraph['working_paragraph'] = (start + i == index)
+def merge_contexts(previous: Context, context: Context):
+  """Returns the context covering both `previous` and the next `context`, with the working paragraphs of both."""
+  return Context(previous.start, max(previous.end, context.end), previous.working_indexes + context.working_indexes)
+
+def iter_instructions(paragraphs, context_level: int, include_edits: bool, merge=False, window: ParagraphWindow = None, select=None):
+  """
+  Yields a context view for every paragraph with comments or insertions/deletions, as soon as its trailing context has been read from `paragraphs` (any iterable).
+  `select` can further restrict the working paragraphs to those it returns True for (e.g. `ParagraphManifest.has_changed`).
+  The paragraphs are kept in `window` (which the contexts index into) only while a context may still need them, so memory is O(context_level) paragraphs instead of O(document).
+  With `merge`, contexts that overlap or are adjacent are coalesced into a single context with several working paragraphs, so shared context paragraphs are only written once.
+  Merged contexts are held until no later context can touch them, so a long run of working paragraphs is kept in memory until it ends.
+  """
+  window = window if window is not None else ParagraphWindow()
+  pending = deque() # Working paragraphs waiting for their trailing context
+  block = None # Merged context waiting to see if the next context touches it
+
+  def ready_contexts(end_of_document):
+    nonlocal block
+    while pending and (end_of_document or pending[0] + context_level < len(window)):
+      context = get_context(window, pending.popleft(), context_level)
+      if not merge:
+        yield context
+      elif block is not None and context.start <= block.end:
+        block = merge_contexts(block, context)
+      else:
+        if block is not None:
+          yield block
+        block = context
+
+    # The next context can't start before the next working paragraph's leading context
+    next_start = (pending[0] if pending else len(window)) - context_level
+    if block is not None and (end_of_document or next_start > block.end):
+      yield block
+      block = None
+
+  for paragraph in paragraphs:
+    window.append(paragraph)
+    if is_working_paragraph(paragraph, include_edits) and (select is None or select(paragraph)):
+      pending.append(len(window) - 1)
+    yield from ready_contexts(end_of_document=False)
+
+    # Keep the leading context of upcoming working paragraphs, and anything pending still points to
+    keep_from = (pending[0] if pending else len(window)) - context_level
+    if block is not None:
+      keep_from = min(keep_from, block.start)
+    window.discard_before(keep_from)
+
+  yield from ready_contexts(end_of_document=True)
+
+def generate_instructions(paragraphs: list, context_level: int, include_edits: bool, merge=False):
+  """Returns the list of context views over `paragraphs` around paragraphs with comments or insertions/deletions (see `iter_instructions`)."""
+  return list(iter_instructions(paragraphs, context_level, include_edits, merge))
+
+class ByteCounter:
+  """Text stream that only counts the UTF-8 bytes written to it."""
+  def __init__(self):
+    self.size = 0
+
+  def write(self, text):
+    self.size += len(text.encode("utf-8"))
+
+def estimate_tokens(size):
+  """Rough LLM token count of `size` bytes of English text."""
+  return size // 4
+
+def estimate_text_tokens(text):
+  """Rough LLM token count of `text`, from its UTF-8 size (see `estimate_tokens`). Rounded up, so the counts of several texts never add up to less than the count of them together."""
+  return estimate_tokens(len(text.encode("utf-8")) + 3)
+
+def estimate_text_tokens_by_words(text):
+  """Rough LLM token count of `text`, from its number of words (about 4 tokens for every 3 English words)."""
+  return (len(text.split()) * 4 + 2) // 3
+
+# Local token estimators, any other function taking a text and returning its token count can be passed instead
+TOKEN_ESTIMATORS = {"bytes": estimate_text_tokens, "words": estimate_text_tokens_by_words}
+
+def write_instruction_block(file, paragraphs, context: Context):
+  """Writes a single instruction block to the text stream `file`, `context` being a view over `paragraphs`."""
+  file.write("===\n")
+  file.write(f"Current context:\n")
   
-  return context
-
-def generate_instructions(paragraphs, context_level: int, include_edits: bool):
-  instructions = []  # List to hold paragraphs with comments or insertions/deletions ([paragraph[]])
-  for index, paragraph in enumerate(paragraphs):
-    # Check if the paragraph has comments or insertions/deletions
-    if paragraph['comments'] or (has_edits(paragraph['content']) and include_edits):
-      # Add context for the paragraph (paragraphs surrounding the current paragraph that has comments or edits)
-      context = get_context(paragraphs, index, context_level)
-      instructions.append(context)
+  for index in range(context.start, context.end):
+    content = render_spans_txt(paragraphs[index].spans)
+    if index in context.working_indexes:
+      file.write("{" + content + "}\n")
+    else:
+      file.write(f"{content}\n")
+
+  # Write comments and their replies for the working paragraphs
+  comments = [(paragraphs[index], comment) for index in context.working_indexes for comment in paragraphs[index].comments]
+  file.write("\nComment(s):\n")
+  if len(comments) == 0:
+    file.write("!NONE!\n")
+  else:
+    for paragraph, comment in comments:
+      anchor = render_spans_txt(slice_spans(paragraph.spans, comment["start"], comment["end"]))
+      every_comment = ". ".join([comment["content"]] + [r["content"] for r in comment["replies"]]) # "[main_comment]. [reply1]. [reply2...]."
+      file.write(f"[{anchor}] -> {every_comment}.\n")
+
+TXT_HEADER = "```txt\n" # declare format when passing it to AI agent
+TXT_FOOTER = "===\n```" # Content End, then Format Block End
+
+def write_instructions_txt(file, paragraphs, instructions):
+  """Writes the instructions to the text stream `file` in the specified format, one block at a time as `instructions` (an iterable of context views over `paragraphs`) produces them."""
+  file.write(TXT_HEADER)
   
-  return instructions
+  # Content Start
+  for context in instructions:
+    write_instruction_block(file, paragraphs, context)
+    
+  file.write(TXT_FOOTER)
+
+def render_instruction_txt(paragraphs, context: Context):
+  """Returns a single instruction block as text (see `write_instruction_block`)."""
+  block = io.StringIO()
+  write_instruction_block(block, paragraphs, context)
+  return block.getvalue()
+
+def build_instruction_record(paragraphs, context: Context):
+  """
+  Returns a single instruction as JSON-compatible data, `context` being a view over `paragraphs`:
+    - working_paragraph_ids (list[str]): paraIds of the working paragraphs (several when contexts were merged).
+    - context (list[dict]): Every paragraph of the context, with its id, spans (see `render_spans_json`), whether it's a working paragraph and, for convenience, its text formatted like the txt output.
+    - edits (list[dict]): Insertions and deletions of the working paragraphs, with their paragraph_id, kind, text and offset in the paragraph's plain text.
+    - comments (list[dict]): Comments of the working paragraphs, with their id, paragraph_id, anchor_spans (and their start/end offsets), content and replies (id and content), and the anchor formatted like the txt output.
+  """
+  working_paragraphs = [paragraphs[index] for index in context.working_indexes]
+  return {
+    "working_paragraph_ids": [paragraph.id for paragraph in working_paragraphs],
+    "context": [
+      {
+        "id": paragraphs[index].id, "spans": render_spans_json(paragraphs[index].spans), "working": index in context.working_indexes,
+        "text": render_spans_txt(paragraphs[index].spans),
+      }
+      for index in range(context.start, context.end)
+    ],
+    "edits": [
+      {"paragraph_id": paragraph.id, "kind": span.kind, "text": span.text, "offset": span.offset}
+      for paragraph in working_paragraphs for span in paragraph.spans if span.kind != SPAN_TEXT
+    ],
+    "comments": [
+      {
+        "id": comment["id"], "paragraph_id": paragraph.id,
+        "anchor_spans": render_spans_json(anchor_spans), "start": comment["start"], "end": comment["end"],
+        "content": comment["content"], "replies": [{"id": reply["id"], "content": reply["content"]} for reply in comment["replies"]],
+        "anchor": render_spans_txt(anchor_spans),
+      }
+      for paragraph in working_paragraphs for comment in paragraph.comments
+      for anchor_spans in [slice_spans(paragraph.spans, comment["start"], comment["end"])]
+    ],
+  }
+
+def render_instruction_jsonl(paragraphs, context: Context):
+  """Returns a single instruction as a line of JSON (see `build_instruction_record`)."""
+  return json.dumps(build_instruction_record(paragraphs, context), ensure_ascii=False) + "\n"
+
+def write_instructions_jsonl(file, paragraphs, instructions):
+  """Writes the instructions to the text stream `file` as JSON Lines, one object per instruction (see `build_instruction_record`) as `instructions` produces them."""
+  for context in instructions:
+    file.write(render_instruction_jsonl(paragraphs, context))
+
+# Every output format: `write` takes (file, paragraphs, instructions), `render` returns a single instruction for (paragraphs, context),
+# and any chunk of the output is made of the header, some rendered instructions and the footer
+OutputFormat = namedtuple("OutputFormat", ["write", "render", "header", "footer"])
+OUTPUT_FORMATS = {
+  "txt": OutputFormat(write_instructions_txt, render_instruction_txt, TXT_HEADER, TXT_FOOTER),
+  "jsonl": OutputFormat(write_instructions_jsonl, render_instruction_jsonl, "", ""),
+}
+
+def get_chunk_file(output_file, number):
+  stem, extension = os.path.splitext(output_file)
+  return f"{stem}_{number:03d}{extension}"
+
+def remove_stale_chunk_files(output_file, chunk_files: list[str]):
+  """Removes the numbered chunk files of `output_file` left by an earlier run that aren't in `chunk_files`, so globbing the chunks never picks up old instructions."""
+  stem, extension = os.path.splitext(output_file)
+  chunk_pattern = re.compile(re.escape(os.path.basename(stem)) + r"_\d{3,}" + re.escape(extension))
+  current = {os.path.abspath(file) for file in chunk_files}
+  for path in glob.glob(f"{glob.escape(stem)}_*{glob.escape(extension)}"):
+    if chunk_pattern.fullmatch(os.path.basename(path)) and os.path.abspath(path) not in current:
+      os.remove(path)
+
+def remove_temp_files(paths: list[str]):
+  """Removes the temporary files of a failed write, best effort so the original error isn't masked."""
+  for path in paths:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+@contextmanager
+def open_output_file(path):
+  """
+  Opens a temporary file next to `path` for writing, moved over `path` only once the block completes.
+  The instructions are written while the document is parsed, so a parse error mustn't truncate the output of an earlier run.
+  """
+  temp_path = f"{path}.{os.getpid()}.tmp"
+  try:
+    with open(temp_path, "w", encoding="utf-8") as file:
+      yield file
+    os.replace(temp_path, path)
+  except BaseException:
+    remove_temp_files([temp_path])
+    raise
+
+def write_instruction_chunks(output_file, paragraphs, instructions, output_format: OutputFormat, max_tokens: int, estimator=estimate_text_tokens):
+  """
+  Writes the instructions to numbered files next to `output_file` (e.g. "proofread_instructions_001.txt"), starting a new file whenever the next instruction would take the current one past `max_tokens` (as counted by `estimator`).
+  Instructions are never split, one that doesn't fit in `max_tokens` on its own gets a file to itself. There's always at least one file, even without instructions.
+  Chunk files of `output_file` from an earlier run are only replaced once every chunk has been written, and the ones beyond them are removed.
+  Returns:
+    list[str]: The paths of the files written, in order.
+  """
+  overhead = estimator(output_format.header + output_format.footer)
+  chunk_files, temp_files = [], []
+  file, chunk_tokens = None, 0
 
-def export_instructions_to_txt(instructions, output_path):
+  def open_chunk():
+    chunk_files.append(get_chunk_file(output_file, len(chunk_files) + 1))
+    temp_files.append(f"{chunk_files[-1]}.{os.getpid()}.tmp")
+    chunk = open(temp_files[-1], "w", encoding="utf-8")
+    chunk.write(output_format.header)
+    return chunk
+
+  try:
+    for context in instructions:
+      block = output_format.render(paragraphs, context)
+      tokens = estimator(block)
+      if file is not None and chunk_tokens + tokens > max_tokens:
+        file.write(output_format.footer)
+        file.close()
+        file = None
+      if file is None:
+        file = open_chunk()
+        chunk_tokens = overhead
+      file.write(block)
+      chunk_tokens += tokens
+
+    if file is None:
+      file = open_chunk()
+    file.write(output_format.footer)
+  except BaseException:
+    if file is not None:
+      file.close()
+    remove_temp_files(temp_files)
+    raise
+  file.close()
+  for temp_file, chunk_file in zip(temp_files, chunk_files):
+    os.replace(temp_file, chunk_file)
+  remove_stale_chunk_files(output_file, chunk_files)
+  return chunk_files
+
+def export_instructions_to_txt(paragraphs, instructions, output_path):
   """Exports the paragraphs and their associated comments to a .txt file in the specified format."""
   with open(output_path, "w", encoding="utf-8") as file:
-    file.write("```txt\n") # declare format when passing it to AI agent
-    
-    # Content Start
-    for context in instructions:
-      file.write("===\n")
-      file.write(f"Current context:\n")
-      
-      # Write comments and their replies if comments exist
-      working_paragraph = None
-      for paragraph in context:
-        if paragraph['working_paragraph']:
-          file.write("{" + paragraph['content'] + "}\n")
-          working_paragraph = paragraph
-        else:
-          file.write(f"{paragraph['content']}\n")
+    write_instructions_txt(file, paragraphs, instructions)
+
+class ParagraphCache:
+  """
+  On-disk cache of the paragraphs (and their comments) extracted from .docx files, stored as one JSON file per document.
+  Entries are keyed by the name, CRC and size of every member of the .docx zip, so a cache lookup only reads the zip's central directory.
+  Once the cache grows past `max_size` bytes, the least recently used entries are evicted.
+  The cache is only an optimisation: errors reading or writing it (e.g. an unwritable directory, or an entry evicted by another batch worker) are logged and skipped.
+  """
+  def __init__(self, directory=DEFAULT_CACHE_DIR, max_size=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+    self.directory = directory
+    self.max_size = max_size
+
+  @staticmethod
+  def get_key(docx: zipfile.ZipFile, *options):
+    """Returns the key of the entry for `docx`, parsed with the given `options` (anything changing the paragraph records)."""
+    members = sorted(f"{info.filename}:{info.CRC:08x}:{info.file_size}" for info in docx.infolist())
+    return hashlib.sha256("\n".join([f"v{CACHE_VERSION}", *map(str, options)] + members).encode("utf-8")).hexdigest()
+
+  def get_path(self, key):
+    return os.path.join(self.directory, f"{key}.json")
+
+  def load(self, key):
+    """Returns the cached paragraphs for `key`, or None on a cache miss."""
+    path = self.get_path(key)
+    try:
+      with open(path, "r", encoding="utf-8") as file:
+        paragraphs = json.load(file)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError) as e:
+      logger.warning(f"Couldn't read the cache entry '{path}', ignoring it: {e}")
+      return None
+    try:
+      os.utime(path) # Mark the entry as recently used
+    except OSError as e:
+      logger.warning(f"Couldn't update the cache entry '{path}': {e}")
+    return paragraphs
+
+  def store(self, key, paragraphs):
+    path = self.get_path(key)
+    # Write to a temporary file first so concurrent batch workers never read a partial entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(paragraphs, file, ensure_ascii=False)
+      os.replace(temp_path, path)
+    except OSError as e:
+      logger.warning(f"Couldn't write the cache entry '{path}', skipping the cache: {e}")
+      remove_temp_files([temp_path])
+      return
+    self.evict()
+
+  def evict(self):
+    """Removes the least recently used entries until the cache fits in `max_size`."""
+    entries = []
+    try:
+      scanned = list(os.scandir(self.directory))
+    except OSError as e:
+      logger.warning(f"Couldn't list the cache directory '{self.directory}', skipping eviction: {e}")
+      return
+    for entry in scanned:
+      if entry.name.endswith(".json"):
+        try:
+          stat = entry.stat()
+        except OSError:
+          continue # Evicted by another process in the meantime
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total_size <= self.max_size:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass # Already evicted by another process
+      except OSError as e:
+        logger.warning(f"Couldn't evict the cache entry '{path}': {e}")
+        continue
+      total_size -= size
+
+class ParagraphManifest:
+  """
+  The w14:textId and comment IDs of every paragraph of a document as of the last run, saved as JSON next to its instructions for `--incremental` runs.
+  Paragraphs without a w14:textId are always taken as changed.
+  """
+  def __init__(self, paragraphs: dict = None):
+    self.paragraphs = paragraphs if paragraphs is not None else {} # { "{paraId}": { "text_id": str | None, "comments": list[str] } }
+
+  @classmethod
+  def load(cls, path):
+    """Returns the manifest saved in `path`, or an empty one (everything changed) if there's none yet."""
+    try:
+      with open(path, "r", encoding="utf-8") as file:
+        return cls(json.load(file)["paragraphs"])
+    except (OSError, ValueError, KeyError):
+      return cls()
+
+  def save(self, path):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+      json.dump({"paragraphs": self.paragraphs}, file)
+    os.replace(temp_path, path)
+
+  def has_changed(self, paragraph: Paragraph):
+    """Checks if the paragraph is new, its text changed or it got new comments or replies since the manifest was saved."""
+    entry = self.paragraphs.get(paragraph.id)
+    if entry is None or paragraph.text_id is None or entry["text_id"] != paragraph.text_id:
+      return True
+    return not set(paragraph.get_comment_ids()).issubset(entry["comments"])
+
+  def track(self, paragraphs):
+    """Passes `paragraphs` along, recording each one in the manifest."""
+    for paragraph in paragraphs:
+      self.paragraphs[paragraph.id] = {"text_id": paragraph.text_id, "comments": paragraph.get_comment_ids()}
+      yield paragraph
+
+def get_triage_prefix(root_tag: bytes):
+  """
+  Returns the prefix bound to the "w" namespace by the namespace declarations of the root start tag `root_tag`,
+  None when the namespace is the default one or isn't declared there, as the raw markup can't be matched reliably then.
+  """
+  namespace = NAMESPACES["w"].encode("utf-8")
+  prefix = None
+  for declared_prefix, _, uri in TRIAGE_XMLNS_PATTERN.findall(root_tag):
+    if uri != namespace:
+      continue
+    if not declared_prefix:
+      return None
+    prefix = declared_prefix
+  return prefix
+
+def scan_needs_review(document_xml, edits=True, chunk_size=TRIAGE_CHUNK_SIZE):
+  """
+  Scans the raw bytes of word/document.xml (a binary stream) for comment ranges, and insertions/deletions when `edits`, stopping at the first one found.
+  A document without any of them can't have working paragraphs, so it doesn't need to be parsed.
+  The elements are matched with the prefix the root element binds to the "w" namespace; documents where it can't be found are always reviewed.
+  """
+  data = b""
+  root = None
+  while root is None:
+    chunk = document_xml.read(chunk_size)
+    if not chunk:
+      return True # No root start tag, left for the parser to report
+    data += chunk
+    root = TRIAGE_ROOT_PATTERN.match(data)
+  prefix = get_triage_prefix(root.group(0))
+  if prefix is None:
+    return True
+  elements = TRIAGE_ELEMENTS if edits else TRIAGE_COMMENTS_ELEMENTS
+  pattern = re.compile(b"<" + re.escape(prefix) + b":(?:" + b"|".join(elements) + rb")[\s/>]")
+  overlap = TRIAGE_OVERLAP + len(prefix)
+  while True:
+    if pattern.search(data):
+      return True
+    tail = data[-overlap:]
+    chunk = document_xml.read(chunk_size)
+    if not chunk:
+      return False
+    data = tail + chunk
+
+def open_docx(source):
+  """Opens the .docx file `source`: a path, the bytes of the file (bytes, bytearray or memoryview) or a seekable binary file object, read in place without temporary files."""
+  if isinstance(source, (bytes, bytearray, memoryview)):
+    source = io.BytesIO(source)
+  return zipfile.ZipFile(source, "r")
+
+def docx_needs_review(source, edits=True):
+  """Runs `scan_needs_review` on the .docx file `source` (see `open_docx`), decompressing word/document.xml as it's scanned."""
+  with open_docx(source) as docx, docx.open(DOCUMENT_PART) as document_xml:
+    return scan_needs_review(document_xml, edits)
+
+def iter_parsed_paragraphs(docx: zipfile.ZipFile, streaming=False, backend: XmlBackend = None, profiler: Profiler = None, include_resolved=False):
+  """Yields the paragraphs of the opened .docx file, each with the comments anchored to it (without resolved threads unless `include_resolved`)."""
+  backend = backend or XmlBackend()
+  profiler = profiler or Profiler(enabled=False)
+
+  # Documents without comments don't have the comments parts at all
+  members = docx.namelist()
+  with profiler.stage("unzip"):
+    comments_xml = docx.read(COMMENTS_PART) if COMMENTS_PART in members else None
+    comments_extended_xml = docx.read(COMMENTS_EXTENDED_PART) if COMMENTS_EXTENDED_PART in members else None
+  with profiler.stage("parse"):
+    comments_root = backend.parse(io.BytesIO(comments_xml)) if comments_xml is not None else None
+    comments_extended_root = backend.parse(io.BytesIO(comments_extended_xml)) if comments_extended_xml is not None else None
+  with profiler.stage("comments"):
+    comment_index = build_comment_index(comments_root) if comments_root is not None else {}
+    comment_threads = build_comment_threads(comments_root, comments_extended_root) if comments_root is not None and comments_extended_root is not None else None
 
-      # Write comments and their replies for the active paragraph
-      file.write("\nComment(s):\n")
-      if len(working_paragraph['comments']) == 0:
-        file.write("!NONE!\n")
+  if streaming:
+    with docx.open(DOCUMENT_PART) as document_xml:
+      # Decompression, parsing and extraction are interleaved, so they can only be timed together
+      yield from profiler.iterate("streaming", iter_paragraphs_streaming(document_xml, comment_index, backend, comment_threads, include_resolved))
+    return
+
+  with profiler.stage("unzip"):
+    document_xml = docx.read(DOCUMENT_PART)
+  with profiler.stage("parse"):
+    document_root = backend.parse(io.BytesIO(document_xml))
+  del document_xml
+
+  with profiler.stage("extract_paragraphs"):
+    paragraphs = extract_paragraphs(document_root)
+
+  with profiler.stage("comments"):
+    comment_ranges = resolve_comment_ranges(document_root)
+    for paragraph in paragraphs:
+      paragraph.comments = extract_comments_from_paragraph(comment_index, comment_ranges.get(paragraph.id, {}), comment_threads, include_resolved)
+
+  yield from paragraphs
+
+def iter_docx_paragraphs(source, streaming=False, cache: ParagraphCache = None, backend: XmlBackend = None, profiler: Profiler = None, include_resolved=False):
+  """Yields the paragraphs of the .docx file `source` (see `open_docx`), from `cache` when given and the file was parsed before."""
+  profiler = profiler or Profiler(enabled=False)
+  with open_docx(source) as docx:
+    if cache is None:
+      yield from iter_parsed_paragraphs(docx, streaming, backend, profiler, include_resolved)
+      return
+
+    with profiler.stage("cache_load"):
+      cache_key = cache.get_key(docx, f"include_resolved={include_resolved}")
+      paragraphs = cache.load(cache_key)
+    if paragraphs is not None:
+      yield from map(Paragraph.from_dict, paragraphs)
+      return
+
+    # The cache entry needs every paragraph, so they're collected while being passed along
+    paragraphs = []
+    for paragraph in iter_parsed_paragraphs(docx, streaming, backend, profiler, include_resolved):
+      paragraphs.append(paragraph)
+      yield paragraph
+    with profiler.stage("cache_store"):
+      cache.store(cache_key, [paragraph.to_dict() for paragraph in paragraphs])
+
+def count_paragraphs(paragraphs, profiler: Profiler):
+  """Passes `paragraphs` along, counting them and their comments and replies in `profiler`."""
+  for paragraph in paragraphs:
+    profiler.count("paragraphs")
+    profiler.count("comments", len(paragraph.comments))
+    profiler.count("replies", sum(len(comment["replies"]) for comment in paragraph.comments))
+    yield paragraph
+
+def count_instructions(instructions, window: ParagraphWindow, context_level: int, merge: bool, profiler: Profiler):
+  """Passes `instructions` along, counting them in `profiler`. Merged contexts are also measured against the separate blocks they replace."""
+  for context in instructions:
+    profiler.count("instructions", len(context.working_indexes))
+    if merge:
+      profiler.count("merged_instructions")
+      unmerged_size, merged_size = ByteCounter(), ByteCounter()
+      for index in context.working_indexes:
+        write_instruction_block(unmerged_size, window, get_context(window, index, context_level))
+      write_instruction_block(merged_size, window, context)
+      profiler.count("bytes_saved_by_merge", unmerged_size.size - merged_size.size)
+    yield context
+
+def proofread_docx(source, output_file, *, context_level=0, edits=False, streaming=False, cache: ParagraphCache = None, backend: XmlBackend = None, profiler: Profiler = None, merge=False, include_resolved=False, manifest_file=None, output_format="txt", max_tokens=None, token_estimator=estimate_text_tokens):
+  """
+  Extracts the proofreading instructions of a single .docx file `source` (a path, or the file's contents as in `open_docx`) and writes them to `output_file`, recording the time of every stage in `profiler`.
+  The paragraphs flow through generators, so each instruction block is written as soon as its trailing context is known.
+  With `merge`, overlapping or adjacent contexts are written as a single block (see `iter_instructions`).
+  Comment threads marked as resolved in Word are skipped unless `include_resolved`.
+  Documents that the triage pre-scan (see `scan_needs_review`) finds nothing to review in are not parsed, an empty set of instructions is written right away.
+  With a `manifest_file`, only paragraphs that changed or got new comments since the run that saved it are working paragraphs, and it's updated once the instructions are written.
+  `output_format` is one of `OUTPUT_FORMATS`. With `max_tokens`, the output is split into numbered files next to `output_file` (see `write_instruction_chunks`).
+  Returns:
+    list[str]: The paths of the output files written.
+  """
+  # Validate the path, contents in memory are only checked when opened as a zip
+  if isinstance(source, (str, os.PathLike)):
+    if not os.path.isfile(source):
+      raise FileNotFoundError(f"The file '{source}' does not exist.")
+
+    if not os.fspath(source).lower().endswith(".docx"):
+      raise ValueError(f"The file '{source}' is not a .docx file.")
+
+  if output_format not in OUTPUT_FORMATS:
+    raise ValueError(f"Unknown output format '{output_format}', expected one of: {', '.join(OUTPUT_FORMATS)}.")
+
+  profiler = profiler or Profiler(enabled=False)
+  with profiler.stage("other"):
+    with profiler.stage("triage"):
+      needs_review = docx_needs_review(source, edits)
+
+    window = ParagraphWindow()
+    if needs_review:
+      paragraphs = count_paragraphs(iter_docx_paragraphs(source, streaming, cache, backend, profiler, include_resolved), profiler)
+      select = None
+      if manifest_file is not None:
+        previous_manifest, manifest = ParagraphManifest.load(manifest_file), ParagraphManifest()
+        paragraphs, select = manifest.track(paragraphs), previous_manifest.has_changed
+      instructions = profiler.iterate("generate_instructions", iter_instructions(paragraphs, context_level, edits, merge, window, select))
+      instructions = count_instructions(instructions, window, context_level, merge, profiler)
+    else:
+      profiler.count("skipped_by_triage")
+      instructions = []
+
+    with profiler.stage("export"):
+      if max_tokens is None:
+        with open_output_file(output_file) as file:
+          OUTPUT_FORMATS[output_format].write(file, window, instructions)
+        output_files = [output_file]
       else:
-        for comment in working_paragraph['comments']:
-          every_comment = ". ".join([comment["content"]] + [r["content"] for r in comment["replies"]]) # "[main_comment]. [reply1]. [reply2...]."
-          file.write(f"[{comment['anchor']}] -> {every_comment}.\n")
-      
-    # Content End
-    file.write("===\n")
-    # Format Block End
-    file.write("```")
+        output_files = write_instruction_chunks(output_file, window, instructions, OUTPUT_FORMATS[output_format], max_tokens, token_estimator)
+        profiler.count("chunks", len(output_files))
+    profiler.count("bytes_written", sum(os.path.getsize(file) for file in output_files))
+
+    if needs_review and manifest_file is not None:
+      manifest.save(manifest_file)
+  return output_files
+
+class Instruction:
+  """A proofreading instruction returned by `proofread`: a view (Context) over the paragraphs of the document, nothing is copied."""
+  __slots__ = ("paragraphs", "context")
+
+  def __init__(self, paragraphs: list[Paragraph], context: Context):
+    self.paragraphs = paragraphs
+    self.context = context
+
+  @property
+  def context_paragraphs(self):
+    return [self.paragraphs[index] for index in range(self.context.start, self.context.end)]
+
+  @property
+  def working_paragraphs(self):
+    return [self.paragraphs[index] for index in self.context.working_indexes]
+
+  @property
+  def comments(self):
+    """The comments of the working paragraphs."""
+    return [comment for paragraph in self.working_paragraphs for comment in paragraph.comments]
+
+  def to_dict(self):
+    """Returns the instruction as JSON-compatible data (see `build_instruction_record`)."""
+    return build_instruction_record(self.paragraphs, self.context)
+
+  def to_txt(self):
+    """Returns the instruction as a txt block (see `write_instruction_block`)."""
+    return render_instruction_txt(self.paragraphs, self.context)
+
+class ProofreadResult:
+  """The paragraphs of a document (each with its comments) and the instructions generated over them, as returned by `proofread`."""
+  __slots__ = ("paragraphs", "instructions")
+
+  def __init__(self, paragraphs: list[Paragraph], instructions: list[Instruction]):
+    self.paragraphs = paragraphs
+    self.instructions = instructions
+
+  @property
+  def comments(self):
+    """The comments of every paragraph, in order."""
+    return [comment for paragraph in self.paragraphs for comment in paragraph.comments]
+
+  def render(self, output_format="txt"):
+    """Returns the whole output, as `proofread_docx` would write it in `output_format` (one of `OUTPUT_FORMATS`)."""
+    output = io.StringIO()
+    OUTPUT_FORMATS[output_format].write(output, self.paragraphs, [instruction.context for instruction in self.instructions])
+    return output.getvalue()
+
+def proofread(source, context_level=0, edits=False, merge=False, include_resolved=False, streaming=False, cache: ParagraphCache = None, backend: XmlBackend = None):
+  """
+  Library entry point: extracts the paragraphs, comments and proofreading instructions of the .docx file `source` (a path, the bytes of the file or a seekable binary file object) and returns them as a ProofreadResult.
+  Nothing is written or printed (warnings about ignored comments go through `logging`), and nothing is kept between calls apart from the optional `cache`.
+  The options are the same as `proofread_docx`'s. Unlike it, every document is parsed (no triage pre-scan), so `paragraphs` never depends on the selection options.
+  """
+  paragraphs = list(iter_docx_paragraphs(source, streaming, cache, backend, None, include_resolved))
+  instructions = [Instruction(paragraphs, context) for context in iter_instructions(paragraphs, context_level, edits, merge)]
+  return ProofreadResult(paragraphs, instructions)
+
+async def proofread_async(source, executor: Executor = None, semaphore: asyncio.Semaphore = None, **options):
+  """
+  Awaitable `proofread` (same `options`), running the zip reading and XML extraction in `executor` (the event loop's default thread pool if None) so the event loop isn't blocked.
+  With a `semaphore`, at most as many calls as it allows run at once, the others wait for it without taking a worker.
+  A process pool needs picklable arguments, so file objects are read into bytes before being sent to it.
+  Cancelling the task cancels the work if it hasn't started yet, work already running in the pool is left to finish and its result is dropped.
+  """
+  if semaphore is not None:
+    async with semaphore:
+      return await proofread_async(source, executor, None, **options)
+
+  if isinstance(executor, ProcessPoolExecutor) and not isinstance(source, (str, os.PathLike, bytes)):
+    source = bytes(source) if isinstance(source, (bytearray, memoryview)) else source.read()
+  return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(proofread, source, **options))
+
+class AsyncProofreader:
+  """
+  Runs `proofread` calls from asyncio code over its own pool of `max_workers` threads (or processes with `use_processes`, for CPU-bound work that shouldn't share the GIL),
+  with at most `max_concurrency` calls in flight at once (default: `max_workers`, or the number of CPUs). Use it as an async context manager, or call `close` once done.
+  """
+  def __init__(self, max_workers=None, use_processes=False, max_concurrency=None):
+    self.executor = ProcessPoolExecutor(max_workers) if use_processes else ThreadPoolExecutor(max_workers)
+    self.semaphore = asyncio.Semaphore(max_concurrency or max_workers or os.cpu_count() or 1)
+
+  async def proofread(self, source, **options):
+    """Same as `proofread` (see `proofread_async`)."""
+    return await proofread_async(source, self.executor, self.semaphore, **options)
+
+  def close(self):
+    """Shuts the pool down, cancelling the calls that haven't started yet."""
+    self.executor.shutdown(wait=False, cancel_futures=True)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    self.close()
+
+def warm_up_worker(barrier):
+  """
+  Runs in every worker of the `serve` pool on start-up, so the first requests don't pay for imports and process creation.
+  Waits on the shared `barrier` (one party per worker) so that no worker picks up a second warm-up task while another one hasn't started yet.
+  """
+  XmlBackend()
+  barrier.wait(WARM_UP_TIMEOUT)
+  return os.getpid()
+
+def serve_proofread(data: bytes, output_format="txt", backend: XmlBackend = None, **options):
+  """
+  Worker for `serve`: runs `proofread` on the uploaded .docx contents and renders it in `output_format` (one of `SERVE_CONTENT_TYPES`).
+  Returns:
+    tuple[bytes, int, float]: The response body, number of instructions and seconds spent.
+  """
+  start = time.perf_counter()
+  with open_docx(data) as docx:
+    if DOCUMENT_PART not in docx.namelist():
+      raise zipfile.BadZipFile(f"There is no {DOCUMENT_PART} part in the archive.")
+  result = proofread(data, backend=backend, **options)
+  if output_format == "json":
+    body = json.dumps({"instructions": [instruction.to_dict() for instruction in result.instructions]}, ensure_ascii=False)
+  else:
+    body = result.render(output_format)
+  return body.encode("utf-8"), len(result.instructions), time.perf_counter() - start
+
+def parse_bool(value: str):
+  if value.lower() in ("1", "true", "yes", "on"):
+    return True
+  if value.lower() in ("0", "false", "no", "off", ""):
+    return False
+  raise ValueError(f"Invalid boolean value '{value}'.")
+
+class ProofreadServer(ThreadingHTTPServer):
+  """HTTP server of `serve`, handing the extraction of every request over to the worker pool `executor`."""
+  def __init__(self, address, executor: Executor, backend: XmlBackend = None, max_upload_size=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024):
+    super().__init__(address, ProofreadRequestHandler)
+    self.executor = executor
+    self.backend = backend
+    self.max_upload_size = max_upload_size
+
+class ProofreadRequestHandler(BaseHTTPRequestHandler):
+  """
+  `GET /health` answers "ok".
+  `POST /proofread?context_level=1&edits=1&format=txt` takes the .docx file as the raw request body and answers with its instructions (see `serve`).
+  """
+  server: ProofreadServer
+
+  def log_message(self, format, *args):
+    logger.info(f"{self.address_string()} {format % args}")
+
+  def send_body(self, status, body: bytes, content_type="text/plain; charset=utf-8", headers=None):
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    if urlparse(self.path).path == "/health":
+      self.send_body(200, b"ok")
+    else:
+      self.send_body(404, b"Not found")
+
+  def do_POST(self):
+    start = time.perf_counter()
+    url = urlparse(self.path)
+    if url.path != "/proofread":
+      self.send_body(404, b"Not found")
+      return
+
+    try:
+      query = {name: values[-1] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+      output_format = query.get("format", "txt")
+      if output_format not in SERVE_CONTENT_TYPES:
+        raise ValueError(f"Unknown format '{output_format}', expected one of: {', '.join(SERVE_CONTENT_TYPES)}.")
+      options = {
+        "context_level": int(query.get("context_level", 0)),
+        "edits": parse_bool(query.get("edits", "0")),
+        "merge": parse_bool(query.get("merge", "0")),
+        "include_resolved": parse_bool(query.get("include_resolved", "0")),
+      }
+      length = self.headers.get("Content-Length")
+      size = int(length) if length is not None else None
+      if size is not None and size < 0:
+        raise ValueError(f"Invalid Content-Length '{length}'.")
+    except ValueError as e:
+      self.send_body(400, str(e).encode("utf-8"))
+      return
+
+    if size is None:
+      self.send_body(411, b"The Content-Length header is required.")
+      self.close_connection = True
+      return
+    if size > self.server.max_upload_size:
+      self.send_body(413, f"The upload is larger than {self.server.max_upload_size} bytes.".encode("utf-8"))
+      self.close_connection = True
+      return
+    data = self.rfile.read(size)
+
+    submitted = time.perf_counter()
+    future = self.server.executor.submit(serve_proofread, data, output_format, self.server.backend, **options)
+    try:
+      body, instructions, proofread_time = future.result()
+    except (zipfile.BadZipFile, ValueError, SyntaxError) as e: # SyntaxError covers ET.ParseError and lxml's XMLSyntaxError
+      self.send_body(400, f"Couldn't read the .docx file: {type(e).__name__}: {e}".encode("utf-8"))
+      return
+    except Exception as e:
+      logger.exception("Proofreading request failed")
+      self.send_body(500, f"{type(e).__name__}: {e}".encode("utf-8"))
+      return
+
+    total_time = time.perf_counter() - start
+    wait_time = total_time - proofread_time - (submitted - start)
+    self.send_body(200, body, SERVE_CONTENT_TYPES[output_format], {
+      "Server-Timing": f"upload;dur={(submitted - start) * 1000:.1f}, queue;dur={max(wait_time, 0) * 1000:.1f}, proofread;dur={proofread_time * 1000:.1f}, total;dur={total_time * 1000:.1f}",
+      "X-Instructions": str(instructions),
+    })
+
+def serve(host="127.0.0.1", port=DEFAULT_SERVE_PORT, jobs=None, backend: XmlBackend = None, max_upload_size=DEFAULT_MAX_UPLOAD_MB * 1024 * 1024):
+  """
+  Serves the extraction over HTTP (see `ProofreadRequestHandler`) until interrupted, on localhost by default.
+  Requests are handled in threads and the extraction runs in a pool of `jobs` worker processes (default: one per CPU) started and warmed up beforehand,
+  so no request pays for interpreter start-up or imports. Per-request timings are returned in the Server-Timing header.
+  """
+  jobs = jobs or os.cpu_count() or 1
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    with multiprocessing.Manager() as manager:
+      barrier = manager.Barrier(jobs)
+      workers = set(executor.map(warm_up_worker, [barrier] * jobs))
+    server = ProofreadServer((host, port), executor, backend, max_upload_size)
+    logger.warning(f"Serving on http://{host}:{server.server_address[1]} with {len(workers)}/{jobs} warm worker(s), press Ctrl+C to stop.")
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+
+def serve_main(argv: list[str]):
+  parser = argparse.ArgumentParser(prog="main.py serve", description="Serve the extraction of proofreading instructions over HTTP: POST a DOCX file to /proofread?context_level=N&edits=1&format=txt|jsonl|json.")
+  parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on (default: 127.0.0.1).")
+  parser.add_argument("--port", type=int, default=DEFAULT_SERVE_PORT, help=f"Port to listen on (default: {DEFAULT_SERVE_PORT}).")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes (default: number of CPUs).")
+  parser.add_argument("--xml_backend", choices=XML_BACKENDS, default="auto", help="XML library used for parsing, 'auto' uses etree as the extraction is faster over its elements (default: auto).")
+  parser.add_argument("--max_upload_size", type=int, default=DEFAULT_MAX_UPLOAD_MB, help=f"Largest DOCX file accepted, in MB (default: {DEFAULT_MAX_UPLOAD_MB}).")
+  args = parser.parse_args(argv)
+  logging.basicConfig(level=logging.WARNING, format="%(message)s")
+  serve(args.host, args.port, args.jobs, XmlBackend(args.xml_backend), args.max_upload_size * 1024 * 1024)
+
+def expand_docx_paths(inputs: list[str]):
+  """
+  Expands the CLI inputs (files, directories and glob patterns) into the list of .docx files to process.
+  Returns:
+    tuple[list[str], bool]: The .docx paths, and whether the inputs call for batch mode (more than one input, a directory or a glob pattern).
+  """
+  docx_paths = []
+  is_batch = len(inputs) > 1
+  for path in inputs:
+    if os.path.isdir(path):
+      matches = glob.glob(os.path.join(path, "*.docx"))
+      is_batch = True
+    elif glob.has_magic(path):
+      matches = glob.glob(path, recursive=True)
+      is_batch = True
+    else:
+      matches = [path]
+    # Skip the lock files Word leaves next to open documents
+    docx_paths.extend(sorted(m for m in matches if not os.path.basename(m).startswith("~$")))
+  return docx_paths, is_batch
+
+def batch_output_file(docx_path, output_path, output_format="txt"):
+  stem = os.path.splitext(os.path.basename(docx_path))[0]
+  return os.path.join(output_path, f"{stem}_proofread_instructions.{output_format}")
+
+def get_manifest_file(docx_path, output_path):
+  stem = "stdin" if docx_path == STDIN_PATH else os.path.splitext(os.path.basename(docx_path))[0]
+  return os.path.join(output_path, f"{stem}.proofread_manifest.json")
+
+def proofread_batch_item(docx_path, output_file, profile=False, **options):
+  """
+  Worker for batch mode, running `proofread_docx` with the keyword arguments `options`.
+  Returns (docx_path, elapsed seconds, error message or None, profile) instead of raising, so one bad file doesn't stop the batch.
+  """
+  start = time.perf_counter()
+  profiler = Profiler(enabled=profile)
+  try:
+    proofread_docx(docx_path, output_file, profiler=profiler, **options)
+    error = None
+  except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+  return docx_path, time.perf_counter() - start, error, profiler.to_dict()
+
+def proofread_batch(docx_paths: list[str], output_path, *, context_level=0, edits=False, streaming=False, cache: ParagraphCache = None, backend: XmlBackend = None, jobs=None, merge=False, profile=False, include_resolved=False, incremental=False, output_format="txt", max_tokens=None, token_estimator=estimate_text_tokens):
+  """
+  Processes every file in `docx_paths` over a process pool of `jobs` workers (default: one per CPU), each file getting its own output file in `output_path`.
+  With `incremental`, each file also gets its own manifest in `output_path` (see `ParagraphManifest`).
+  Returns:
+    list[tuple]: (docx_path, elapsed seconds, error message or None, profile) for each file, in the order of `docx_paths`.
+  """
+  output_files = [batch_output_file(docx_path, output_path, output_format) for docx_path in docx_paths]
+  duplicates = {f for f in output_files if output_files.count(f) > 1}
+  if duplicates:
+    raise ValueError(f"Several input files would be written to the same output file: {', '.join(sorted(duplicates))}")
+
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    futures = [
+      executor.submit(
+        proofread_batch_item, docx_path, output_file, profile=profile, context_level=context_level, edits=edits, streaming=streaming, cache=cache, backend=backend,
+        merge=merge, include_resolved=include_resolved, manifest_file=get_manifest_file(docx_path, output_path) if incremental else None,
+        output_format=output_format, max_tokens=max_tokens, token_estimator=token_estimator,
+      )
+      for docx_path, output_file in zip(docx_paths, output_files)
+    ]
+    return [future.result() for future in futures]
+
+def triage_batch_item(docx_path, edits):
+  """Worker for `--list-needing-review`. Returns (docx_path, whether it needs review or None on error, error message or None)."""
+  try:
+    return docx_path, docx_needs_review(docx_path, edits), None
+  except Exception as e:
+    return docx_path, None, f"{type(e).__name__}: {e}"
+
+def list_needing_review(docx_paths: list[str], edits=True, jobs=None):
+  """
+  Prints the path of every file in `docx_paths` that needs review according to the triage pre-scan, without generating any instructions, and a summary of the whole set.
+  Returns:
+    bool: Whether every file could be scanned.
+  """
+  start = time.perf_counter()
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    results = list(executor.map(triage_batch_item, docx_paths, [edits] * len(docx_paths), chunksize=16))
+
+  for docx_path, needs_review, error in results:
+    if error is not None:
+      print(f"FAILED  {docx_path}: {error}", file=sys.stderr)
+    elif needs_review:
+      print(docx_path)
+  needing_review = sum(1 for _, needs_review, _ in results if needs_review)
+  failures = sum(1 for _, _, error in results if error is not None)
+  print(f"{needing_review} of {len(results)} file(s) need review ({failures} failed), scanned in {time.perf_counter() - start:.2f}s", file=sys.stderr)
+  return failures == 0
+
+def print_batch_summary(results, elapsed):
+  failures = [result for result in results if result[2] is not None]
+  print(f"Processed {len(results)} file(s) in {elapsed:.2f}s ({len(results) - len(failures)} succeeded, {len(failures)} failed)")
+  for docx_path, file_elapsed, error, _ in results:
+    status = "ok" if error is None else "FAILED"
+    print(f"  {file_elapsed:8.2f}s  {status:<6}  {docx_path}" + (f": {error}" if error else ""))
+
+def report_merge_savings(profiler: Profiler):
+  saved = profiler.counters["bytes_saved_by_merge"]
+  print(f"Merged {profiler.counters['instructions']} instruction block(s) into {profiler.counters['merged_instructions']}, saving {saved} bytes (~{estimate_tokens(saved)} tokens).")
+
+def report_profile(profiler: Profiler, print_report=False, json_path=None):
+  if print_report:
+    print(profiler.format_report())
+  if json_path:
+    with open(json_path, "w", encoding="utf-8") as file:
+      json.dump(profiler.to_dict(), file, indent=2)
 
 def main():
-  parser = argparse.ArgumentParser(description="Extract paragraphs and comments from a DOCX file.")
-  parser.add_argument("docx_path", help="Path to the input DOCX file.")
+  if sys.argv[1:2] == ["serve"]:
+    serve_main(sys.argv[2:])
+    return
+
+  parser = argparse.ArgumentParser(description="Extract paragraphs and comments from DOCX files.")
+  parser.add_argument("docx_path", nargs="+", help="Path to the input DOCX file. Several paths, directories or glob patterns run in batch mode, writing one '<name>_proofread_instructions.<format>' per input. '-' reads a single DOCX file from stdin.")
   parser.add_argument("-o", "--output_path", type=str, default=os.getcwd(), help="Directory for the output TXT file (default: current directory).")
   parser.add_argument("-c", "--context_level", type=int, default=0, help="Number of surrounding paragraphs to include as context (default: 0).")
   parser.add_argument("-e", "--edits", action="store_true", help="Include edits as part of the criteria for selecting working paragraphs in the set of instructions (default: False).")
+  parser.add_argument("--streaming", action="store_true", help="Read word/document.xml incrementally to keep memory bounded on very large documents (default: False).")
+  parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes in batch mode (default: number of CPUs).")
+  parser.add_argument("--cache", action="store_true", help="Cache the parsed paragraphs and comments on disk, so later runs on the same unchanged file skip XML parsing (default: False).")
+  parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR, help=f"Directory of the cache (default: {DEFAULT_CACHE_DIR}).")
+  parser.add_argument("--cache_size", type=int, default=DEFAULT_CACHE_SIZE_MB, help=f"Maximum size of the cache in MB, least recently used entries are evicted past it (default: {DEFAULT_CACHE_SIZE_MB}).")
+  parser.add_argument("--xml_backend", choices=XML_BACKENDS, default="auto", help="XML library used for parsing, 'auto' uses etree as the extraction is faster over its elements (default: auto).")
+  parser.add_argument("--profile", action="store_true", help="Print the wall time, CPU time and item counts of every stage (default: False).")
+  parser.add_argument("--profile-json", type=str, default=None, help="Write the stage timings and item counts as JSON to this file.")
+  parser.add_argument("-m", "--merge", action="store_true", help="Write overlapping or adjacent contexts as a single instruction block with several working paragraphs, and report the bytes/tokens saved (default: False).")
+  parser.add_argument("--include_resolved", action="store_true", help="Include the comment threads marked as resolved in Word, which are skipped otherwise (default: False).")
+  parser.add_argument("-f", "--format", choices=list(OUTPUT_FORMATS), default="txt", help="Output format: the fenced 'txt' blocks, or 'jsonl' with one JSON object per instruction (default: txt).")
+  parser.add_argument("--max_tokens", type=int, default=None, help="Split the output into numbered files of at most this many (estimated) tokens each, without ever splitting an instruction block (default: a single file).")
+  parser.add_argument("--token_estimator", choices=list(TOKEN_ESTIMATORS), default="bytes", help="How tokens are estimated for --max_tokens: 'bytes' (UTF-8 size / 4) or 'words' (4 tokens per 3 words) (default: bytes).")
+  parser.add_argument("--incremental", action="store_true", help="Only select paragraphs whose text changed or that got new comments since the last --incremental run, tracked in a '<name>.proofread_manifest.json' file in the output directory (default: False).")
+  parser.add_argument("--list-needing-review", action="store_true", help="Only print the inputs that have comments (or insertions/deletions with -e), using a fast scan of the raw XML, without writing any instructions (default: False).")
   args = parser.parse_args()
+  logging.basicConfig(level=logging.WARNING, format="%(message)s")
 
-  docx_path, output_path, context_level, edits = args.docx_path, args.output_path, args.context_level, args.edits
+  output_path, context_level, edits, streaming = args.output_path, args.context_level, args.edits, args.streaming
+  cache = ParagraphCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache else None
+  backend = XmlBackend(args.xml_backend)
+  profiler = Profiler(enabled=args.profile or bool(args.profile_json))
+  docx_paths, is_batch = expand_docx_paths(args.docx_path)
+  if STDIN_PATH in docx_paths and (is_batch or args.list_needing_review):
+    parser.error(f"'{STDIN_PATH}' (stdin) can only be used as the single input, without --list-needing-review.")
 
-  # Validate docx_path
-  if not os.path.isfile(docx_path):
-    raise FileNotFoundError(f"The file '{docx_path}' does not exist.")
+  if args.list_needing_review:
+    if not list_needing_review(docx_paths, edits, args.jobs):
+      sys.exit(1)
+    return
 
-  if not docx_path.lower().endswith(".docx"):
-    raise ValueError(f"The file '{docx_path}' is not a .docx file.")
+  if not is_batch:
+    output_file = os.path.join(output_path, f"proofread_instructions.{args.format}")
+    manifest_file = get_manifest_file(docx_paths[0], output_path) if args.incremental else None
+    source = sys.stdin.buffer.read() if docx_paths[0] == STDIN_PATH else docx_paths[0]
+    proofread_docx(
+      source, output_file, context_level=context_level, edits=edits, streaming=streaming, cache=cache, backend=backend, profiler=profiler, merge=args.merge,
+      include_resolved=args.include_resolved, manifest_file=manifest_file, output_format=args.format, max_tokens=args.max_tokens,
+      token_estimator=TOKEN_ESTIMATORS[args.token_estimator],
+    )
+    if args.merge:
+      report_merge_savings(profiler)
+    report_profile(profiler, args.profile, args.profile_json)
+    return
 
-  # Parse the XML files we'll be using
-  document_root = None
-  comments_root = None
-  with zipfile.ZipFile(docx_path, "r") as docx:
-    with docx.open("word/document.xml") as document_xml:
-      document_tree = ET.parse(document_xml)
-      document_root = document_tree.getroot()
-    with docx.open("word/comments.xml") as comments_xml:
-      comments_tree = ET.parse(comments_xml)
-      comments_root = comments_tree.getroot()
-
-  paragraphs = extract_paragraphs(document_root)
-
-  for paragraph in paragraphs:
-    paragraph["comments"] = extract_comments_from_paragraph(document_root, comments_root, paragraph["id"])
-  
-  instructions = generate_instructions(paragraphs, context_level, edits)
-  output_file = os.path.join(output_path, "proofread_instructions.txt")
-  export_instructions_to_txt(instructions, output_file)
+  start = time.perf_counter()
+  try:
+    results = proofread_batch(
+      docx_paths, output_path, context_level=context_level, edits=edits, streaming=streaming, cache=cache, backend=backend, jobs=args.jobs, merge=args.merge,
+      profile=profiler.enabled, include_resolved=args.include_resolved, incremental=args.incremental, output_format=args.format, max_tokens=args.max_tokens,
+      token_estimator=TOKEN_ESTIMATORS[args.token_estimator],
+    )
+  except ValueError as e: # Inputs that would be written to the same output file, the files themselves fail in their own result
+    parser.error(str(e))
+  print_batch_summary(results, time.perf_counter() - start)
+  for result in results:
+    profiler.merge(result[3])
+  if args.merge:
+    report_merge_savings(profiler)
+  report_profile(profiler, args.profile, args.profile_json)
+  if any(error is not None for _, _, error, _ in results):
+    sys.exit(1)
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
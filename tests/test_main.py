@@ -3,7 +3,21 @@ import os
 # Add the root directory to sys.path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from main import has_edits
+import http.client
+import io
+import json
+import asyncio
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import zipfile
+import pytest
+import xml.etree.ElementTree as ET
+
+from main import has_edits, resolve_comment_ranges, build_comment_index, get_comment_content, extract_paragraphs, iter_paragraphs_streaming, expand_docx_paths, ParagraphCache, XmlBackend, lxml_etree, Profiler, Context, generate_instructions, iter_instructions, ParagraphWindow, NAMESPACES, Paragraph, Span, SPAN_TEXT, SPAN_INSERTION, SPAN_DELETION, render_spans_txt, slice_spans, build_comment_threads, sort_comment_replies, extract_comments_from_paragraph, scan_needs_review, proofread_docx, ParagraphManifest, write_instructions_jsonl, write_instruction_chunks, OUTPUT_FORMATS, proofread, AsyncProofreader, ProofreadServer, proofread_batch, main
+
+NS_DECLARATIONS = f'xmlns:w="{NAMESPACES["w"]}" xmlns:w14="{NAMESPACES["w14"]}" xmlns:w15="{NAMESPACES["w15"]}"'
 
 def test_has_edits_with_insertion():
     # Test case with insertion (**text**)
@@ -23,4 +37,484 @@ def test_has_edits_with_no_edits():
 def test_has_edits_with_both_insertion_and_deletion():
     # Test case with both insertion and deletion
     content = "This is a **test** and a --sample--."
-    assert has_edits(content) is True
\ No newline at end of file
+    assert has_edits(content) is True
+
+def test_resolve_comment_ranges_groups_comments_by_paragraph():
+    # Test case with nested ranges in one paragraph and a range spanning two paragraphs
+    root = ET.fromstring(
+        f'<w:body {NS_DECLARATIONS}>'
+        '<w:p w14:paraId="0001">'
+        '<w:commentRangeStart w:id="0"/><w:r><w:t>Some </w:t></w:r>'
+        '<w:commentRangeStart w:id="1"/><w:ins><w:r><w:t>new</w:t></w:r></w:ins><w:commentRangeEnd w:id="1"/>'
+        '<w:r><w:t> text</w:t></w:r><w:commentRangeEnd w:id="0"/>'
+        '<w:commentRangeStart w:id="2"/><w:r><w:t>Spanning</w:t></w:r>'
+        '</w:p>'
+        '<w:p w14:paraId="0002"><w:r><w:t>Next</w:t></w:r><w:commentRangeEnd w:id="2"/></w:p>'
+        '</w:body>'
+    )
+    resolved = resolve_comment_ranges(root)
+    assert list(resolved) == ["0001"]
+    assert list(resolved["0001"]) == ["0", "1"]
+    spans = extract_paragraphs(root)[0].spans
+    anchors = {comment_id: render_spans_txt(slice_spans(spans, c["start"], c["end"])) for comment_id, c in resolved["0001"].items()}
+    assert anchors == {"0": "Some **new** text", "1": "**new**"}
+
+def test_get_comment_content_uses_comment_index():
+    # Test case with a comment and its reply looked up by ID
+    comments_root = ET.fromstring(
+        f'<w:comments {NS_DECLARATIONS}>'
+        '<w:comment w:id="0"><w:p><w:r><w:t>check</w:t></w:r></w:p></w:comment>'
+        '<w:comment w:id="1"><w:p><w:r><w:t>agreed</w:t></w:r></w:p></w:comment>'
+        '</w:comments>'
+    )
+    comment_index = build_comment_index(comments_root)
+    comments = [{"id": "0", "start": 0, "end": 4, "content": "", "replies": [{"id": "1"}]}]
+    comments = get_comment_content(comment_index, comments)
+    assert comments[0]["content"] == "check"
+    assert comments[0]["replies"][0]["content"] == "agreed"
+
+def test_iter_paragraphs_streaming_matches_extract_paragraphs():
+    # Test case with commented, edited, empty and table paragraphs
+    document_xml = (
+        f'<w:document {NS_DECLARATIONS}><w:body>'
+        '<w:p w14:paraId="0001"><w:commentRangeStart w:id="0"/><w:r><w:t>Commented</w:t></w:r><w:commentRangeEnd w:id="0"/></w:p>'
+        '<w:p w14:paraId="0002"><w:r><w:t>Edited </w:t></w:r><w:del><w:r><w:delText>old</w:delText></w:r></w:del></w:p>'
+        '<w:p w14:paraId="0003"/>'
+        '<w:tbl><w:tr><w:tc><w:p w14:paraId="0004"><w:r><w:t>Cell</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+        '</w:body></w:document>'
+    )
+    comment_index = build_comment_index(ET.fromstring(
+        f'<w:comments {NS_DECLARATIONS}><w:comment w:id="0"><w:p><w:r><w:t>check</w:t></w:r></w:p></w:comment></w:comments>'
+    ))
+    streamed = list(iter_paragraphs_streaming(io.BytesIO(document_xml.encode()), comment_index))
+    assert [p.id for p in streamed] == [p.id for p in extract_paragraphs(ET.fromstring(document_xml))]
+    assert [render_spans_txt(p.spans) for p in streamed] == ["Commented", "Edited --old--", "Cell"]
+    assert streamed[0].comments[0]["content"] == "check"
+
+def test_expand_docx_paths_batch_inputs(tmp_path):
+    # Test case with a directory (skipping Word lock files) and a single file
+    for name in ["b.docx", "a.docx", "~$a.docx", "notes.txt"]:
+        (tmp_path / name).write_text("")
+    paths, is_batch = expand_docx_paths([str(tmp_path)])
+    assert [os.path.basename(p) for p in paths] == ["a.docx", "b.docx"]
+    assert is_batch is True
+
+    paths, is_batch = expand_docx_paths([str(tmp_path / "a.docx")])
+    assert paths == [str(tmp_path / "a.docx")]
+    assert is_batch is False
+
+def test_proofread_batch_reports_failures(tmp_path, monkeypatch):
+    # Test case with a good and a corrupt .docx file in the process pool, through the CLI for the exit code, and inputs with the same name
+    (tmp_path / "in").mkdir()
+    with zipfile.ZipFile(tmp_path / "in" / "good.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p></w:body></w:document>')
+    (tmp_path / "in" / "corrupt.docx").write_bytes(b"not a zip")
+    docx_paths = [str(tmp_path / "in" / "good.docx"), str(tmp_path / "in" / "corrupt.docx")]
+
+    results = proofread_batch(docx_paths, str(tmp_path), edits=True, jobs=2)
+    assert [(path, error) for path, _, error, _ in results] == [(docx_paths[0], None), (docx_paths[1], "BadZipFile: File is not a zip file")]
+    assert "{**New**}" in (tmp_path / "good_proofread_instructions.txt").read_text()
+    assert not (tmp_path / "corrupt_proofread_instructions.txt").exists()
+
+    monkeypatch.setattr(sys, "argv", ["main.py", str(tmp_path / "in"), "-e", "-o", str(tmp_path), "-j", "2"])
+    with pytest.raises(SystemExit) as exit:
+        main()
+    assert exit.value.code == 1
+
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "good.docx").write_bytes((tmp_path / "in" / "good.docx").read_bytes())
+    monkeypatch.setattr(sys, "argv", ["main.py", docx_paths[0], str(tmp_path / "other" / "good.docx"), "-o", str(tmp_path)])
+    with pytest.raises(SystemExit) as exit:
+        main()
+    assert exit.value.code == 2
+
+def test_paragraph_cache_evicts_least_recently_used(tmp_path):
+    # Test case with a cache that only fits two entries
+    paragraphs = [Paragraph("0001", [Span(SPAN_TEXT, "Text", 0)]).to_dict()]
+    cache = ParagraphCache(str(tmp_path), max_size=2 * len(json.dumps(paragraphs)))
+    cache.store("a", paragraphs)
+    cache.store("b", paragraphs)
+    os.utime(cache.get_path("a"), (0, 0))
+    os.utime(cache.get_path("b"), (1, 1))
+    assert cache.load("a") == paragraphs # Loading "a" makes "b" the least recently used entry
+    cache.store("c", paragraphs)
+    assert cache.load("b") is None
+    assert cache.load("a") == paragraphs
+    assert cache.load("c") == paragraphs
+
+def test_paragraph_cache_errors_are_skipped(tmp_path, monkeypatch):
+    # Test case with a cache directory that is a file, and an entry evicted by another process before it's marked as used
+    (tmp_path / "file").write_text("")
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p></w:body></w:document>')
+    proofread_docx(str(tmp_path / "doc.docx"), str(tmp_path / "out.txt"), edits=True, cache=ParagraphCache(str(tmp_path / "file" / "cache")))
+    assert (tmp_path / "out.txt").read_text().endswith("===\n```")
+
+    paragraphs = [Paragraph("0001", [Span(SPAN_TEXT, "Text", 0)]).to_dict()]
+    cache = ParagraphCache(str(tmp_path / "cache"))
+    cache.store("a", paragraphs)
+    def evicted(path, *args):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.load("a") == paragraphs
+
+@pytest.mark.skipif(lxml_etree is None, reason="lxml is not installed")
+def test_xml_backends_extract_the_same_paragraphs():
+    # Test case with an XML comment, which lxml would otherwise keep as an element
+    document_xml = (
+        f'<w:document {NS_DECLARATIONS}><w:body>'
+        '<w:p w14:paraId="0001"><!-- note --><w:r><w:t>Some </w:t></w:r><w:ins><w:r><w:t>text</w:t></w:r></w:ins></w:p>'
+        '</w:body></w:document>'
+    ).encode()
+    results = [extract_paragraphs(XmlBackend(name).parse(io.BytesIO(document_xml))) for name in ["etree", "lxml"]]
+    assert [p.to_dict() for p in results[0]] == [p.to_dict() for p in results[1]] == [Paragraph("0001", [Span(SPAN_TEXT, "Some ", 0), Span(SPAN_INSERTION, "text", 5)]).to_dict()]
+
+def test_profiler_accumulates_stages_and_counters():
+    # Test case with a stage entered twice and a profile merged from a batch worker
+    profiler = Profiler()
+    for _ in range(2):
+        with profiler.stage("parse"):
+            pass
+    profiler.count("paragraphs", 3)
+    worker = Profiler()
+    with worker.stage("parse"):
+        pass
+    worker.count("paragraphs", 2)
+    profiler.merge(worker.to_dict())
+    assert profiler.stages["parse"]["calls"] == 3
+    assert profiler.counters["paragraphs"] == 5
+
+def test_generate_instructions_returns_views_without_copying():
+    # Test case with a commented paragraph at the start and an edited one in the middle
+    paragraphs = [
+        Paragraph("1", [Span(SPAN_TEXT, "One", 0)], [{"id": "0", "start": 0, "end": 3, "content": "check", "replies": []}]),
+        Paragraph("2", [Span(SPAN_TEXT, "Two", 0)]),
+        Paragraph("3", [Span(SPAN_INSERTION, "Three", 0)]),
+        Paragraph("4", [Span(SPAN_TEXT, "Four", 0)]),
+    ]
+    instructions = generate_instructions(paragraphs, context_level=1, include_edits=True)
+    assert instructions == [Context(0, 2, (0,)), Context(1, 4, (2,))]
+
+def test_generate_instructions_merges_overlapping_and_adjacent_contexts():
+    # Test case with two overlapping contexts, an adjacent one and a separate one
+    comment = {"id": "0", "start": 0, "end": 0, "content": "check", "replies": []}
+    paragraphs = [Paragraph(str(i), [Span(SPAN_TEXT, str(i), 0)], [comment] if i in (1, 2, 4, 8) else []) for i in range(10)]
+    instructions = generate_instructions(paragraphs, context_level=1, include_edits=False, merge=True)
+    assert instructions == [Context(0, 6, (1, 2, 4)), Context(7, 10, (8,))]
+
+def test_iter_instructions_only_keeps_the_context_window():
+    # Test case with a long stream where every 5th paragraph has a comment
+    comment = {"id": "0", "start": 0, "end": 0, "content": "check", "replies": []}
+    paragraphs = (Paragraph(str(i), [Span(SPAN_TEXT, str(i), 0)], [comment] if i % 5 == 0 else []) for i in range(1000))
+    window = ParagraphWindow()
+    for context in iter_instructions(paragraphs, context_level=2, include_edits=False, window=window):
+        assert len(window.paragraphs) <= 2 * 2 + 1
+        assert [window[i].id for i in range(context.start, context.end)] == [str(i) for i in range(context.start, context.end)]
+
+def test_extract_paragraphs_counts_edits_instead_of_matching_markers():
+    # Test case with an author's own dashes and asterisks, and a paragraph with real edits
+    root = ET.fromstring(
+        f'<w:body {NS_DECLARATIONS}>'
+        '<w:p w14:paraId="0001"><w:r><w:t>A dash -- in **plain** text -- here</w:t></w:r></w:p>'
+        '<w:p w14:paraId="0002"><w:ins><w:r><w:t>new</w:t></w:r></w:ins><w:del><w:r><w:delText>old</w:delText></w:r></w:del><w:del/></w:p>'
+        '</w:body>'
+    )
+    paragraphs = extract_paragraphs(root)
+    assert (paragraphs[0].insertions, paragraphs[0].deletions) == (0, 0)
+    assert (paragraphs[1].insertions, paragraphs[1].deletions) == (1, 1)
+    assert [c.working_indexes for c in generate_instructions(paragraphs, 0, include_edits=True)] == [(1,)]
+
+def test_paragraph_spans_render_and_round_trip():
+    # Test case with consecutive runs, an insertion split over two runs and a deletion
+    root = ET.fromstring(
+        f'<w:body {NS_DECLARATIONS}><w:p w14:paraId="0001">'
+        '<w:r><w:t>Some </w:t></w:r><w:r><w:t>text</w:t></w:r>'
+        '<w:ins><w:r><w:t> new</w:t></w:r><w:r><w:t>er</w:t></w:r></w:ins><w:del><w:r><w:delText> old</w:delText></w:r></w:del>'
+        '</w:p></w:body>'
+    )
+    paragraph = extract_paragraphs(root)[0]
+    assert paragraph.spans == [Span(SPAN_TEXT, "Some text", 0), Span(SPAN_INSERTION, " newer", 9), Span(SPAN_DELETION, " old", 15)]
+    assert render_spans_txt(paragraph.spans) == "Some text** newer**-- old--"
+    restored = Paragraph.from_dict(json.loads(json.dumps(paragraph.to_dict())))
+    assert (restored.id, restored.spans, restored.insertions, restored.deletions) == ("0001", paragraph.spans, 1, 1)
+
+def test_comment_anchor_offsets_inside_edits():
+    # Test case with a range starting inside an insertion and ending inside a later run
+    root = ET.fromstring(
+        f'<w:body {NS_DECLARATIONS}><w:p w14:paraId="0001">'
+        '<w:r><w:t>Keep </w:t></w:r><w:ins><w:r><w:t>ne</w:t></w:r><w:commentRangeStart w:id="0"/><w:r><w:t>w</w:t></w:r></w:ins>'
+        '<w:r><w:t> wo</w:t></w:r><w:commentRangeEnd w:id="0"/><w:r><w:t>rds</w:t></w:r>'
+        '</w:p></w:body>'
+    )
+    comment = resolve_comment_ranges(root)["0001"]["0"]
+    assert (comment["start"], comment["end"]) == (7, 11)
+    assert render_spans_txt(slice_spans(extract_paragraphs(root)[0].spans, comment["start"], comment["end"])) == "**w** wo"
+
+def test_sort_comment_replies_threads_from_comments_extended():
+    # Test case with two separate comments on the same text and a reply to the second one
+    comments_root = ET.fromstring(
+        f'<w:comments {NS_DECLARATIONS}>'
+        '<w:comment w:id="0"><w:p w14:paraId="A0"><w:r><w:t>first</w:t></w:r></w:p></w:comment>'
+        '<w:comment w:id="1"><w:p w14:paraId="B0"><w:r><w:t>second</w:t></w:r></w:p><w:p w14:paraId="B1"/></w:comment>'
+        '<w:comment w:id="2"><w:p w14:paraId="C0"><w:r><w:t>reply</w:t></w:r></w:p></w:comment>'
+        '</w:comments>'
+    )
+    comments_extended_root = ET.fromstring(
+        f'<w15:commentsEx {NS_DECLARATIONS}>'
+        '<w15:commentEx w15:paraId="A0" w15:done="0"/><w15:commentEx w15:paraId="B1" w15:done="0"/>'
+        '<w15:commentEx w15:paraId="C0" w15:paraIdParent="B1" w15:done="0"/>'
+        '</w15:commentsEx>'
+    )
+    comments = {comment_id: {"start": 0, "end": 4, "content": "", "replies": []} for comment_id in ["0", "1", "2"]}
+    threaded = sort_comment_replies(comments, build_comment_threads(comments_root, comments_extended_root))
+    assert [(c["id"], [r["id"] for r in c["replies"]]) for c in threaded] == [("0", []), ("1", ["2"])]
+    # Without commentsExtended.xml, comments on the same range are grouped
+    assert [(c["id"], [r["id"] for r in c["replies"]]) for c in sort_comment_replies(comments)] == [("0", ["1", "2"])]
+
+def test_extract_comments_from_paragraph_skips_resolved_threads():
+    # Test case with a resolved thread (done on its top-level comment) and an open one
+    comments_root = ET.fromstring(
+        f'<w:comments {NS_DECLARATIONS}>'
+        '<w:comment w:id="0"><w:p w14:paraId="A0"><w:r><w:t>fixed</w:t></w:r></w:p></w:comment>'
+        '<w:comment w:id="1"><w:p w14:paraId="B0"><w:r><w:t>thanks</w:t></w:r></w:p></w:comment>'
+        '<w:comment w:id="2"><w:p w14:paraId="C0"><w:r><w:t>open</w:t></w:r></w:p></w:comment>'
+        '</w:comments>'
+    )
+    comments_extended_root = ET.fromstring(
+        f'<w15:commentsEx {NS_DECLARATIONS}>'
+        '<w15:commentEx w15:paraId="A0" w15:done="1"/><w15:commentEx w15:paraId="B0" w15:paraIdParent="A0" w15:done="0"/>'
+        '<w15:commentEx w15:paraId="C0" w15:done="0"/>'
+        '</w15:commentsEx>'
+    )
+    comment_index = build_comment_index(comments_root)
+    comment_threads = build_comment_threads(comments_root, comments_extended_root)
+    paragraph_comments = {comment_id: {"start": 0, "end": 4, "content": "", "replies": []} for comment_id in ["0", "1", "2"]}
+    comments = extract_comments_from_paragraph(comment_index, paragraph_comments, comment_threads)
+    assert [c["content"] for c in comments] == ["open"]
+    comments = extract_comments_from_paragraph(comment_index, paragraph_comments, comment_threads, include_resolved=True)
+    assert [(c["content"], [r["content"] for r in c["replies"]]) for c in comments] == [("fixed", ["thanks"]), ("open", [])]
+
+def test_scan_needs_review_finds_markup_across_chunks():
+    # Test case with the only comment range split between two chunks, and an insertion that only counts with edits
+    document_xml = f'<?xml version="1.0"?>\n<w:document {NS_DECLARATIONS}><w:body>'.encode() + b'x' * 100 + b'<w:p><w:commentRangeStart w:id="0"/></w:p></w:body></w:document>'
+    assert scan_needs_review(io.BytesIO(document_xml), edits=False, chunk_size=300) is True
+    document_xml = f'<w:document {NS_DECLARATIONS}><w:body><w:p><w:ins w:id="0"><w:r><w:t>new</w:t></w:r></w:ins><w:instrText>x</w:instrText></w:p></w:body></w:document>'.encode()
+    assert scan_needs_review(io.BytesIO(document_xml), edits=False, chunk_size=8) is False
+    assert scan_needs_review(io.BytesIO(document_xml), edits=True, chunk_size=8) is True
+
+def test_scan_needs_review_uses_the_declared_prefix():
+    # Test case with the "w" namespace bound to another prefix, as the default namespace, and not declared on the root element
+    namespace = NAMESPACES["w"]
+    document_xml = f'<x:document xmlns:x="{namespace}"><x:body><x:p><x:commentRangeStart x:id="0"/></x:p></x:body></x:document>'.encode()
+    assert scan_needs_review(io.BytesIO(document_xml), edits=False, chunk_size=8) is True
+    document_xml = f'<x:document xmlns:x="{namespace}" xmlns:w="urn:other"><w:commentRangeStart/><x:body/></x:document>'.encode()
+    assert scan_needs_review(io.BytesIO(document_xml), edits=False) is False
+    document_xml = f'<document xmlns="{namespace}"><body><p><r><t>Plain</t></r></p></body></document>'.encode()
+    assert scan_needs_review(io.BytesIO(document_xml), edits=False) is True
+    assert scan_needs_review(io.BytesIO(b'<w:document><w:body/></w:document>'), edits=False) is True
+
+def test_proofread_docx_without_comments_part(tmp_path):
+    # Test case with documents that have no word/comments.xml, with and without insertions
+    for name, body in [("plain", '<w:r><w:t>Plain</w:t></w:r>'), ("edited", '<w:ins><w:r><w:t>New</w:t></w:r></w:ins>')]:
+        with zipfile.ZipFile(tmp_path / f"{name}.docx", "w") as docx:
+            docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001">{body}</w:p></w:body></w:document>')
+    profiler = Profiler()
+    proofread_docx(str(tmp_path / "plain.docx"), str(tmp_path / "plain.txt"), edits=True, profiler=profiler)
+    assert (tmp_path / "plain.txt").read_text() == "```txt\n===\n```"
+    assert profiler.counters["skipped_by_triage"] == 1
+    proofread_docx(str(tmp_path / "edited.docx"), str(tmp_path / "edited.txt"), edits=True)
+    assert "{**New**}" in (tmp_path / "edited.txt").read_text()
+
+def test_proofread_docx_keeps_previous_output_on_parse_error(tmp_path):
+    # Test case with a truncated document.xml after a good run, for a single output file and for chunk files
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p></w:body></w:document>')
+    with zipfile.ZipFile(tmp_path / "broken.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p><w:p><w:ins>')
+    for max_tokens in [None, 100]:
+        output_files = proofread_docx(str(tmp_path / "doc.docx"), str(tmp_path / "out.txt"), edits=True, max_tokens=max_tokens)
+        before = [open(file).read() for file in output_files]
+        with pytest.raises(SyntaxError):
+            proofread_docx(str(tmp_path / "broken.docx"), str(tmp_path / "out.txt"), edits=True, max_tokens=max_tokens)
+        assert [open(file).read() for file in output_files] == before
+        assert not list(tmp_path.glob("*.tmp"))
+
+def test_paragraph_manifest_selects_changed_paragraphs(tmp_path):
+    # Test case with an unchanged paragraph, an edited one, one with a new reply and a new one
+    def make_paragraphs(text_ids):
+        return [Paragraph(str(i), [Span(SPAN_TEXT, str(i), 0)], [{"id": str(i), "start": 0, "end": 0, "content": "check", "replies": []}], text_id) for i, text_id in enumerate(text_ids)]
+
+    manifest = ParagraphManifest()
+    list(manifest.track(make_paragraphs(["A", "B", "C"])))
+    manifest.save(str(tmp_path / "manifest.json"))
+
+    previous = ParagraphManifest.load(str(tmp_path / "manifest.json"))
+    paragraphs = make_paragraphs(["A", "B2", "C", "D"])
+    paragraphs[2].comments[0]["replies"].append({"id": "9", "content": "no"})
+    instructions = generate_instructions(paragraphs, 0, include_edits=False)
+    assert len(instructions) == 4
+    assert [c.working_indexes for c in iter_instructions(paragraphs, 0, False, select=previous.has_changed)] == [(1,), (2,), (3,)]
+    assert ParagraphManifest.load(str(tmp_path / "missing.json")).has_changed(paragraphs[0]) is True
+
+def test_write_instructions_jsonl_one_object_per_instruction():
+    # Test case with a commented and edited working paragraph and a context paragraph
+    paragraphs = [
+        Paragraph("1", [Span(SPAN_TEXT, "Some ", 0), Span(SPAN_INSERTION, "new", 5), Span(SPAN_TEXT, " text", 8)], [{"id": "0", "start": 5, "end": 13, "content": "check", "replies": [{"id": "1", "content": "ok"}]}]),
+        Paragraph("2", [Span(SPAN_TEXT, "Next", 0)]),
+    ]
+    file = io.StringIO()
+    write_instructions_jsonl(file, paragraphs, generate_instructions(paragraphs, context_level=1, include_edits=True))
+    records = [json.loads(line) for line in file.getvalue().splitlines()]
+    assert records == [{
+        "working_paragraph_ids": ["1"],
+        "context": [
+            {"id": "1", "spans": [{"kind": "text", "text": "Some "}, {"kind": "insertion", "text": "new"}, {"kind": "text", "text": " text"}], "working": True, "text": "Some **new** text"},
+            {"id": "2", "spans": [{"kind": "text", "text": "Next"}], "working": False, "text": "Next"},
+        ],
+        "edits": [{"paragraph_id": "1", "kind": "insertion", "text": "new", "offset": 5}],
+        "comments": [{
+            "id": "0", "paragraph_id": "1", "anchor_spans": [{"kind": "insertion", "text": "new"}, {"kind": "text", "text": " text"}], "start": 5, "end": 13,
+            "content": "check", "replies": [{"id": "1", "content": "ok"}], "anchor": "**new** text",
+        }],
+    }]
+
+def test_write_instruction_chunks_packs_whole_blocks_under_budget(tmp_path):
+    # Test case with ten one-paragraph blocks, a budget fitting three of them and an estimator counting characters
+    comment = {"id": "0", "start": 0, "end": 0, "content": "check", "replies": []}
+    paragraphs = [Paragraph(str(i), [Span(SPAN_TEXT, f"Paragraph {i}", 0)], [comment]) for i in range(10)]
+    instructions = generate_instructions(paragraphs, 0, include_edits=False)
+    block_size = len(OUTPUT_FORMATS["txt"].render(paragraphs, instructions[0]))
+    overhead = len(OUTPUT_FORMATS["txt"].header + OUTPUT_FORMATS["txt"].footer)
+    chunk_files = write_instruction_chunks(str(tmp_path / "out.txt"), paragraphs, instructions, OUTPUT_FORMATS["txt"], overhead + 3 * block_size, len)
+    assert [os.path.basename(f) for f in chunk_files] == ["out_001.txt", "out_002.txt", "out_003.txt", "out_004.txt"]
+    chunks = [open(f, encoding="utf-8").read() for f in chunk_files]
+    assert all(chunk.startswith("```txt\n") and chunk.endswith("===\n```") for chunk in chunks)
+    assert [chunk.count("Current context:") for chunk in chunks] == [3, 3, 3, 1]
+    # A budget smaller than a block still writes every block whole
+    chunk_files = write_instruction_chunks(str(tmp_path / "small.jsonl"), paragraphs, instructions, OUTPUT_FORMATS["jsonl"], 1, len)
+    assert len(chunk_files) == 10
+
+def test_proofread_returns_objects_without_printing(tmp_path, capsys, caplog):
+    # Test case with a commented paragraph, an edited one and a comment range left open, from a path and from bytes
+    document_xml = (
+        f'<w:document {NS_DECLARATIONS}><w:body>'
+        '<w:p w14:paraId="0001"><w:commentRangeStart w:id="0"/><w:r><w:t>Commented</w:t></w:r><w:commentRangeEnd w:id="0"/></w:p>'
+        '<w:p w14:paraId="0002"><w:r><w:t>Edited </w:t></w:r><w:ins><w:r><w:t>text</w:t></w:r></w:ins><w:commentRangeStart w:id="1"/></w:p>'
+        '</w:body></w:document>'
+    )
+    comments_xml = (
+        f'<w:comments {NS_DECLARATIONS}>'
+        '<w:comment w:id="0"><w:p><w:r><w:t>check</w:t></w:r></w:p></w:comment><w:comment w:id="1"><w:p><w:r><w:t>lost</w:t></w:r></w:p></w:comment>'
+        '</w:comments>'
+    )
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", document_xml)
+        docx.writestr("word/comments.xml", comments_xml)
+
+    result = proofread(str(tmp_path / "doc.docx"), context_level=1, edits=True)
+    assert [p.id for p in result.paragraphs] == ["0001", "0002"]
+    assert [c["content"] for c in result.comments] == ["check"]
+    assert [[p.id for p in i.working_paragraphs] for i in result.instructions] == [["0001"], ["0002"]]
+    assert result.instructions[0].to_dict()["comments"][0]["anchor"] == "Commented"
+    assert proofread((tmp_path / "doc.docx").read_bytes(), context_level=1, edits=True).render() == result.render()
+    assert capsys.readouterr().out == ""
+    assert "comment with ID=1" in caplog.text
+
+def test_proofread_docx_from_memory(tmp_path):
+    # Test case with the same document passed as a path, bytes, a memoryview and a binary stream
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p></w:body></w:document>')
+    data = (tmp_path / "doc.docx").read_bytes()
+    outputs = []
+    for i, source in enumerate([str(tmp_path / "doc.docx"), data, memoryview(data), io.BytesIO(data)]):
+        proofread_docx(source, str(tmp_path / f"out{i}.txt"), edits=True)
+        outputs.append((tmp_path / f"out{i}.txt").read_text())
+    assert "{**New**}" in outputs[0]
+    assert outputs == [outputs[0]] * 4
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_async_proofreader_runs_in_pool_and_cancels(tmp_path, use_processes):
+    # Test case with concurrent calls from bytes and a stream, limited to one at a time, and a call cancelled while waiting its turn
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:del><w:r><w:delText>Old</w:delText></w:r></w:del></w:p></w:body></w:document>')
+    data = (tmp_path / "doc.docx").read_bytes()
+
+    async def run():
+        async with AsyncProofreader(max_workers=2, use_processes=use_processes, max_concurrency=1) as proofreader:
+            results = await asyncio.gather(proofreader.proofread(data, edits=True), proofreader.proofread(io.BytesIO(data), edits=True))
+            waiting = [asyncio.create_task(proofreader.proofread(data, edits=True)) for _ in range(3)]
+            await asyncio.sleep(0)
+            waiting[-1].cancel()
+            done = await asyncio.gather(*waiting, return_exceptions=True)
+        return results, done
+
+    results, done = asyncio.run(run())
+    assert [result.render() for result in results] == ["```txt\n===\nCurrent context:\n{--Old--}\n\nComment(s):\n!NONE!\n===\n```"] * 2
+    assert isinstance(done[-1], asyncio.CancelledError)
+    assert [[p.id for p in result.paragraphs] for result in done[:2]] == [["0001"], ["0001"]]
+
+def test_proofread_server_answers_uploads(tmp_path):
+    # Test case with a txt and a json request, uploads that aren't .docx files or have a malformed document.xml, and missing or negative Content-Length headers
+    with zipfile.ZipFile(tmp_path / "doc.docx", "w") as docx:
+        docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001"><w:ins><w:r><w:t>New</w:t></w:r></w:ins></w:p></w:body></w:document>')
+    data = (tmp_path / "doc.docx").read_bytes()
+    with zipfile.ZipFile(tmp_path / "other.zip", "w") as other:
+        other.writestr("other.xml", "<other/>")
+    with zipfile.ZipFile(tmp_path / "broken.docx", "w") as broken:
+        broken.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p><w:ins>')
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        server = ProofreadServer(("127.0.0.1", 0), executor)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/proofread"
+        try:
+            with urllib.request.urlopen(urllib.request.Request(f"{url}?edits=1", data=data)) as response:
+                assert response.read().decode() == "```txt\n===\nCurrent context:\n{**New**}\n\nComment(s):\n!NONE!\n===\n```"
+                assert "proofread;dur=" in response.headers["Server-Timing"]
+                assert response.headers["X-Instructions"] == "1"
+            with urllib.request.urlopen(urllib.request.Request(f"{url}?edits=1&format=json", data=data)) as response:
+                assert json.loads(response.read())["instructions"][0]["edits"][0]["text"] == "New"
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urllib.request.Request(url, data=b"not a docx"))
+            assert error.value.code == 400
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urllib.request.Request(url, data=(tmp_path / "other.zip").read_bytes()))
+            assert error.value.code == 400
+            with pytest.raises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urllib.request.Request(f"{url}?edits=1", data=(tmp_path / "broken.docx").read_bytes()))
+            assert error.value.code == 400
+            for headers, status in [({}, 411), ({"Content-Length": "-1"}, 400)]:
+                connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+                connection.putrequest("POST", "/proofread")
+                for name, value in headers.items():
+                    connection.putheader(name, value)
+                connection.endheaders()
+                assert connection.getresponse().status == status
+                connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+def test_proofread_returns_paragraphs_without_comments_or_edits(tmp_path):
+    # Test case with a document that has no comments and no edits, and one with an insertion only
+    for name, body in [("plain", '<w:r><w:t>Plain</w:t></w:r>'), ("edited", '<w:ins><w:r><w:t>New</w:t></w:r></w:ins>')]:
+        with zipfile.ZipFile(tmp_path / f"{name}.docx", "w") as docx:
+            docx.writestr("word/document.xml", f'<w:document {NS_DECLARATIONS}><w:body><w:p w14:paraId="0001">{body}</w:p><w:p w14:paraId="0002"><w:r><w:t>Next</w:t></w:r></w:p></w:body></w:document>')
+
+    result = proofread(str(tmp_path / "plain.docx"))
+    assert [p.id for p in result.paragraphs] == ["0001", "0002"]
+    assert (result.comments, result.instructions) == ([], [])
+    for edits in [False, True]:
+        result = proofread(str(tmp_path / "edited.docx"), edits=edits)
+        assert [p.id for p in result.paragraphs] == ["0001", "0002"]
+        assert len(result.instructions) == (1 if edits else 0)
+
+def test_write_instruction_chunks_removes_stale_chunks(tmp_path):
+    # Test case with a rerun on the same output file with a larger budget, next to an unrelated file
+    comment = {"id": "0", "start": 0, "end": 0, "content": "check", "replies": []}
+    paragraphs = [Paragraph(str(i), [Span(SPAN_TEXT, f"Paragraph {i}", 0)], [comment]) for i in range(5)]
+    instructions = generate_instructions(paragraphs, 0, include_edits=False)
+    (tmp_path / "out_notes.txt").write_text("keep")
+    assert len(write_instruction_chunks(str(tmp_path / "out.txt"), paragraphs, instructions, OUTPUT_FORMATS["txt"], 1, len)) == 5
+    assert write_instruction_chunks(str(tmp_path / "out.txt"), paragraphs, instructions, OUTPUT_FORMATS["txt"], 100000, len) == [str(tmp_path / "out_001.txt")]
+    assert sorted(os.listdir(tmp_path)) == ["out_001.txt", "out_notes.txt"]